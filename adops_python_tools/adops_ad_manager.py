@@ -1,31 +1,134 @@
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 
 from googleads.ad_manager import AdManagerClient
 from googleads.oauth2 import GoogleRefreshTokenClient
 from googleads.ad_manager import StatementBuilder
-from typing import Union
+from googleads.common import ZeepServiceProxy
+from typing import Iterable, Iterator, Optional, Union
+from zeep.cache import SqliteCache
 
-from constants import API_VERSION
+from api_metrics import API_METRICS, MetricsPlugin
+from constants import API_VERSION, PAGE_WORKERS, PQL_IN_CHUNK_SIZE, WSDL_CACHE_PATH
 from database import Database
+from helpers import item_chunks
+from rate_limiter import AdaptiveConcurrencyLimiter, limiter_for
 
 logger = logging.getLogger(__name__)
 
+class _ServiceProxy:
+    """Routes every call of an Ad Manager service through the network's concurrency limiter and records metrics."""
+
+    def __init__(self, service, service_name: str, limiter: Optional[AdaptiveConcurrencyLimiter] = None) -> None:
+        self._service = service
+        self._service_name = service_name
+        self._limiter = limiter
+        zeep_client = getattr(service, "zeep_client", None)
+        if zeep_client is not None:
+            zeep_client.plugins.append(MetricsPlugin(API_METRICS, service_name))
+
+    def __getattr__(self, name):
+        attribute = getattr(self._service, name)
+        if not callable(attribute):
+            return attribute
+
+        def on_retry(error):
+            API_METRICS.record_retry(self._service_name, name, fault_name(error))
+
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                if self._limiter:
+                    result = self._limiter.call(attribute, *args, on_retry=on_retry, **kwargs)
+                else:
+                    result = attribute(*args, **kwargs)
+            except Exception as error:
+                API_METRICS.record_call(self._service_name, name, time.perf_counter() - start, fault=fault_name(error))
+                raise
+            API_METRICS.record_call(self._service_name, name, time.perf_counter() - start, result)
+            if name.startswith("Download"):
+                output = next((arg for arg in args if hasattr(arg, "tell")), None)
+                if output is not None:
+                    API_METRICS.record_bytes(self._service_name, name, response_bytes=output.tell())
+            return result
+
+        return call
+
+
+def fault_name(error: Exception) -> str:
+    errors = getattr(error, "errors", None)
+    if errors:
+        try:
+            return errors[0]["errorString"]
+        except (KeyError, TypeError, IndexError):
+            pass
+    return type(error).__name__
+
+
 class AdOpsAdManagerClient:
-    def __init__(self, email, network_code=None) -> None:
+    SERVICES = {
+        "network_service": "NetworkService",
+        "placement_service": "PlacementService",
+        "inventory_service": "InventoryService",
+        "custom_targeting_service": "CustomTargetingService",
+        "site_service": "SiteService",
+        "company_service": "CompanyService",
+        "creative_service": "CreativeService",
+        "user_service": "UserService",
+        "order_service": "OrderService",
+        "line_item_service": "LineItemService",
+        "lica_service": "LineItemCreativeAssociationService",
+        "report_service": "ReportService",
+    }
+
+    def __init__(self, email, network_code=None, use_wsdl_cache=True, ad_manager_client=None) -> None:
         self.email = email
-        self.client = self.set_admanager_client(network_code)
-        self.network_service = self.client.GetService("NetworkService", version=API_VERSION)
-        self.placement_service = self.client.GetService("PlacementService", version=API_VERSION)
-        self.inventory_service = self.client.GetService("InventoryService", version=API_VERSION)
-        self.custom_targeting_service = self.client.GetService("CustomTargetingService", version=API_VERSION)
-        self.site_service = self.client.GetService("SiteService", version=API_VERSION)
-        self.company_service = self.client.GetService("CompanyService", version=API_VERSION)
-        self.creative_service = self.client.GetService("CreativeService", version=API_VERSION)
-        self.user_service = self.client.GetService("UserService", version=API_VERSION)
-        self.order_service = self.client.GetService("OrderService", version=API_VERSION)
-        self.line_item_service = self.client.GetService("LineItemService", version=API_VERSION)
-        self.lica_service = self.client.GetService("LineItemCreativeAssociationService", version=API_VERSION)
-        self.report_downloader = self.client.GetDataDownloader(version=API_VERSION)
+        self.use_wsdl_cache = use_wsdl_cache
+        self.startup_times = {}
+        self._service_lock = threading.Lock()
+        start = time.perf_counter()
+        # ad_manager_client replaces the googleads client, e.g. with fake_ad_manager.FakeAdManagerClient.
+        self.client = ad_manager_client or self.set_admanager_client(network_code)
+        self.startup_times["client"] = time.perf_counter() - start
+
+    def __getattr__(self, name):
+        # Services are only built on first access, each GetService call
+        # parses a WSDL which is the main cost of creating the client.
+        if name != "report_downloader" and name not in self.SERVICES:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        with self._service_lock:
+            if name not in self.__dict__:
+                start = time.perf_counter()
+                if name == "report_downloader":
+                    service = _ServiceProxy(self.client.GetDataDownloader(version=API_VERSION), "DataDownloader")
+                else:
+                    service = _ServiceProxy(
+                        self.client.GetService(self.SERVICES[name], version=API_VERSION),
+                        self.SERVICES[name],
+                        limiter_for(self.client.network_code),
+                    )
+                self.startup_times[name] = time.perf_counter() - start
+                logger.debug(f"{name} built in {self.startup_times[name] * 1000:.0f} ms")
+                self.__dict__[name] = service
+        return self.__dict__[name]
+
+    @cached_property
+    def current_network(self):
+        return self.network_service.getCurrentNetwork()
+
+    @cached_property
+    def all_networks(self) -> list:
+        return self.network_service.getAllNetworks()
+
+    def wsdl_cache(self) -> Union[SqliteCache, str]:
+        if not self.use_wsdl_cache:
+            return ZeepServiceProxy.NO_CACHE
+        os.makedirs(os.path.dirname(WSDL_CACHE_PATH), exist_ok=True)
+        return SqliteCache(path=WSDL_CACHE_PATH, timeout=None)
 
     def set_admanager_client(self, network_code: Union[str, None] = None) -> AdManagerClient:
         credentials = Database().get_credentials(self.email)
@@ -34,10 +137,11 @@ class AdOpsAdManagerClient:
             credentials.client_secret, 
             credentials.refresh_token
         )
+        cache = self.wsdl_cache()
         if network_code:
-            return AdManagerClient(refresh_token_client, credentials.app_name, network_code)
+            return AdManagerClient(refresh_token_client, credentials.app_name, network_code, cache=cache)
             
-        client = AdManagerClient(refresh_token_client, credentials.app_name)
+        client = AdManagerClient(refresh_token_client, credentials.app_name, cache=cache)
         all_networks = client.GetService("NetworkService", version=API_VERSION).getAllNetworks()
         print("Available Ad manager networks:")
         network_codes = {}
@@ -47,7 +151,7 @@ class AdOpsAdManagerClient:
             network_codes.update({f"{index}": network["networkCode"]})
         network_code = network_codes.get(input("Pick number: "))
 
-        return AdManagerClient(refresh_token_client, credentials.app_name, network_code)
+        return AdManagerClient(refresh_token_client, credentials.app_name, network_code, cache=cache)
 
     def build_statement(self, key, value, limit=500, contains=False):
         statement = (
@@ -55,10 +159,10 @@ class AdOpsAdManagerClient:
             .OrderBy(f"{key}", ascending=True)
             .Limit(limit)
         )
-        if isinstance(key, list):
+        if isinstance(value, (list, tuple, set)):
             statement = (statement
             .Where(f"{key} IN (:{key})")
-            .WithBindVariable(f"{key}", ",".join(value))
+            .WithBindVariable(f"{key}", list(value))
             )
         elif contains:
             statement = statement.Where(f"{key} LIKE '%{value}%'")
@@ -70,18 +174,115 @@ class AdOpsAdManagerClient:
 
         return statement
     
-    def get_items_by_statement(self, statement: StatementBuilder, callback):
+    def get_items_by_statement(self, statement: StatementBuilder, callback, parallel=False, max_workers=PAGE_WORKERS):
         logger.info(f"Statement query: {statement.ToStatement()['query']}")
+        if parallel and statement.limit != 1:
+            return self.get_items_by_statement_parallel(statement, callback, max_workers)
         items = []
+        for page in self.iter_pages(statement, callback):
+            if statement.limit == 1:
+                return page
+            items.extend(page)
+
+        return items
+
+    def get_items_by_values(self, key, values, callback, chunk_size=PQL_IN_CHUNK_SIZE, max_workers=PAGE_WORKERS) -> list:
+        """Looks up items whose key is any of values, in concurrent chunked IN statements, deduplicated by id."""
+        chunks = list(item_chunks(list(dict.fromkeys(values)), chunk_size))
+        logger.info(f"Looking up {sum(len(chunk) for chunk in chunks)} values of {key} in {len(chunks)} chunks")
+
+        def lookup(chunk):
+            return self.get_items_by_statement(self.build_statement(key, chunk), callback)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lookup, chunks))
+
+        items = {}
+        for result in results:
+            for item in result:
+                items.setdefault(item["id"], item)
+
+        return list(items.values())
+
+    def perform_action_by_values(self, key, values, action: dict, callback, chunk_size=PQL_IN_CHUNK_SIZE, max_workers=PAGE_WORKERS) -> int:
+        """Performs action on items whose key is any of values, in concurrent chunked IN statements."""
+        chunks = list(item_chunks(list(dict.fromkeys(values)), chunk_size))
+
+        def perform(chunk):
+            result = callback(action, self.build_statement(key, chunk, limit=len(chunk)).ToStatement())
+            return int(result["numChanges"]) if result else 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return sum(executor.map(perform, chunks))
+
+    def iter_pages(self, statement: StatementBuilder, callback) -> Iterator[list]:
         while True:
             response = callback(statement.ToStatement())
             logger.debug(f"startIndex: {response['startIndex']}, totalResultSetSize: {response['totalResultSetSize']}")
             if "results" in response and response["results"]:
+                yield response["results"]
                 if statement.limit == 1:
-                    return response["results"]
-                items.extend(response["results"])
+                    return
                 statement.offset += statement.limit
+                # The last page is known from the total, without requesting an empty one.
+                if statement.offset >= int(response["totalResultSetSize"]):
+                    return
             else:
-                break
+                return
+
+    def iter_items(self, statement: StatementBuilder, callback, fields: Optional[Iterable[str]] = None) -> Iterator:
+        """Yields items page by page. With fields only these attributes are kept, as dicts."""
+        logger.info(f"Statement query: {statement.ToStatement()['query']}")
+        fields = tuple(fields) if fields else None
+        for page in self.iter_pages(statement, callback):
+            for item in page:
+                yield {field: item[field] for field in fields} if fields else item
+
+    def get_items_by_statement_parallel(self, statement: StatementBuilder, callback, max_workers=PAGE_WORKERS):
+        start_offset = statement.offset or 0
+        response = callback(statement.ToStatement())
+        total = response["totalResultSetSize"]
+        logger.debug(f"startIndex: {response['startIndex']}, totalResultSetSize: {total}")
+        if "results" not in response or not response["results"]:
+            return []
+
+        offsets = range(start_offset + statement.limit, total, statement.limit)
+        statements = []
+        for offset in offsets:
+            statement.offset = offset
+            statements.append(statement.ToStatement())
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(executor.map(callback, statements))
+
+        if any(page["totalResultSetSize"] != total for page in responses):
+            logger.warning(f"totalResultSetSize changed during parallel scan (was {total}). Falling back to sequential paging.")
+            statement.offset = start_offset
+            return self.get_items_by_statement(statement, callback)
+
+        items = list(response["results"])
+        for page in responses:
+            if "results" in page and page["results"]:
+                items.extend(page["results"])
+        statement.offset = start_offset + (len(statements) + 1) * statement.limit
+        logger.debug(f"Fetched {len(statements) + 1} pages in parallel, totalResultSetSize: {total}")
 
         return items
+
+def measure_startup(email, network_code, services=("network_service", "report_downloader")) -> dict:
+    """Creates clients with and without the WSDL cache and returns startup times in seconds.
+
+    The cache is filled by an untimed client first, so the cached time is that of a warm cache.
+    """
+    def start_client(use_wsdl_cache: bool) -> float:
+        start = time.perf_counter()
+        client = AdOpsAdManagerClient(email, network_code, use_wsdl_cache=use_wsdl_cache)
+        for service in services:
+            getattr(client, service)
+        return time.perf_counter() - start
+
+    timings = {"uncached": start_client(False)}
+    start_client(True)
+    timings["cached"] = start_client(True)
+    logger.info(f"Client startup without WSDL cache: {timings['uncached']:.2f} s, with cache: {timings['cached']:.2f} s")
+    return timings
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from pathlib import PurePath
+
+from lxml import etree
+from zeep import Plugin
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class MethodMetrics:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.retries = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.faults = Counter()
+        self.pages = 0
+        self.items = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "latencySeconds": {
+                "sum": round(self.latency_sum, 6),
+                "buckets": dict(zip((str(bucket) for bucket in LATENCY_BUCKETS), self.latency_buckets)),
+            },
+            "faults": dict(self.faults),
+            "pages": self.pages,
+            "items": self.items,
+            "requestBytes": self.request_bytes,
+            "responseBytes": self.response_bytes,
+        }
+
+
+class ApiMetrics:
+    """Per service and method counters of Ad Manager API usage, exportable as JSON or Prometheus text."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.methods = defaultdict(MethodMetrics)
+
+    def record_call(self, service: str, method: str, latency: float, result=None, fault: str = None) -> None:
+        with self.lock:
+            metrics = self.methods[(service, method)]
+            metrics.calls += 1
+            metrics.latency_sum += latency
+            for index, bucket in enumerate(LATENCY_BUCKETS):
+                if latency <= bucket:
+                    metrics.latency_buckets[index] += 1
+            if fault:
+                metrics.faults[fault] += 1
+            if result is None:
+                return
+            if isinstance(result, (list, tuple)):
+                metrics.items += len(result)
+            elif hasattr(result, "__contains__") and not isinstance(result, str) and "results" in result:
+                metrics.pages += 1
+                metrics.items += len(result["results"] or [])
+
+    def record_retry(self, service: str, method: str, fault: str) -> None:
+        with self.lock:
+            metrics = self.methods[(service, method)]
+            metrics.retries += 1
+            metrics.faults[fault] += 1
+
+    def record_bytes(self, service: str, method: str, request_bytes: int = 0, response_bytes: int = 0) -> None:
+        with self.lock:
+            metrics = self.methods[(service, method)]
+            metrics.request_bytes += request_bytes
+            metrics.response_bytes += response_bytes
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            result = defaultdict(dict)
+            for (service, method), metrics in sorted(self.methods.items()):
+                result[service][method] = metrics.to_dict()
+            return dict(result)
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        counters = {
+            "gam_api_calls_total": "calls",
+            "gam_api_retries_total": "retries",
+            "gam_api_pages_total": "pages",
+            "gam_api_items_total": "items",
+            "gam_api_request_bytes_total": "request_bytes",
+            "gam_api_response_bytes_total": "response_bytes",
+        }
+        with self.lock:
+            methods = sorted(self.methods.items())
+            for name, attribute in counters.items():
+                lines.append(f"# TYPE {name} counter")
+                for (service, method), metrics in methods:
+                    lines.append(f'{name}{{service="{service}",method="{method}"}} {getattr(metrics, attribute)}')
+
+            lines.append("# TYPE gam_api_faults_total counter")
+            for (service, method), metrics in methods:
+                for fault, count in sorted(metrics.faults.items()):
+                    lines.append(f'gam_api_faults_total{{service="{service}",method="{method}",fault="{fault}"}} {count}')
+
+            lines.append("# TYPE gam_api_latency_seconds histogram")
+            for (service, method), metrics in methods:
+                labels = f'service="{service}",method="{method}"'
+                for bucket, count in zip(LATENCY_BUCKETS, metrics.latency_buckets):
+                    lines.append(f'gam_api_latency_seconds_bucket{{{labels},le="{bucket}"}} {count}')
+                lines.append(f'gam_api_latency_seconds_bucket{{{labels},le="+Inf"}} {metrics.calls}')
+                lines.append(f"gam_api_latency_seconds_sum{{{labels}}} {metrics.latency_sum:.6f}")
+                lines.append(f"gam_api_latency_seconds_count{{{labels}}} {metrics.calls}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str) -> str:
+        """Writes metrics to path, in Prometheus text format for .prom/.txt files and JSON otherwise."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        content = self.to_prometheus() if PurePath(path).suffix in (".prom", ".txt") else self.to_json()
+        with open(path, "w") as metrics_file:
+            metrics_file.write(content)
+        logger.info(f"API metrics exported to {path}")
+        return path
+
+    def log_summary(self, top: int = 10) -> None:
+        with self.lock:
+            methods = sorted(self.methods.items(), key=lambda item: item[1].latency_sum, reverse=True)[:top]
+        for (service, method), metrics in methods:
+            logger.info(
+                f"{service}.{method}: {metrics.calls} calls, {metrics.latency_sum:.1f} s, "
+                f"{metrics.retries} retries, {metrics.pages} pages, {metrics.items} items"
+            )
+
+
+class MetricsPlugin(Plugin):
+    """zeep plugin measuring SOAP envelope sizes of a service."""
+
+    def __init__(self, metrics: ApiMetrics, service: str) -> None:
+        self.metrics = metrics
+        self.service = service
+
+    def egress(self, envelope, http_headers, operation, binding_options):
+        self.metrics.record_bytes(self.service, operation.name, request_bytes=len(etree.tostring(envelope)))
+        return envelope, http_headers
+
+    def ingress(self, envelope, http_headers, operation):
+        self.metrics.record_bytes(self.service, operation.name, response_bytes=len(etree.tostring(envelope)))
+        return envelope, http_headers
+
+
+API_METRICS = ApiMetrics()
@@ -0,0 +1,146 @@
+import gzip
+import io
+import logging
+import os
+from pathlib import PurePath
+from typing import BinaryIO, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+
+def columnar_path(report_path: PurePath) -> PurePath:
+    name = PurePath(report_path).name
+    stem = name[:-len(".csv.gz")] if name.endswith(".csv.gz") else name
+    return PurePath(report_path).with_name(f"{stem}.feather")
+
+
+def optimize_dtypes(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Dimensions become categorical, dimension IDs int64 and metrics the smallest lossless numeric type."""
+    for column in dataframe.columns:
+        series = dataframe[column]
+        if column.startswith("Dimension."):
+            if column.endswith("_ID"):
+                try:
+                    dataframe[column] = pd.to_numeric(series, errors="raise").astype("int64")
+                    continue
+                except (ValueError, TypeError):
+                    pass
+            dataframe[column] = series.astype("category")
+        elif column.startswith("Column."):
+            if pd.api.types.is_integer_dtype(series):
+                dataframe[column] = pd.to_numeric(series, downcast="integer")
+            elif pd.api.types.is_float_dtype(series):
+                downcast = series.astype(np.float32)
+                # Thresholds are compared against metrics, so only exact conversions are kept.
+                if np.array_equal(downcast.astype(np.float64).to_numpy(), series.to_numpy(), equal_nan=True):
+                    dataframe[column] = downcast
+    return dataframe
+
+
+def aggregate_report(dataframe: pd.DataFrame, aggregations: dict) -> pd.DataFrame:
+    """Combines rows with equal dimensions, e.g. of several days or date range shards.
+
+    Metrics are summed. Rates are not additive, so aggregations maps them (without the
+    "Column." prefix) to {"numerator": metric, "denominator": metric, "scale": factor}
+    and they are derived from the summed base metrics, the way Ad Manager computes them
+    for the whole range.
+    """
+    dataframe = dataframe.copy()
+    metrics = [column for column in dataframe.columns if column.startswith("Column.")]
+    dimensions = [column for column in dataframe.columns if not column.startswith("Column.")]
+    ratios = {f"Column.{column}": aggregation for column, aggregation in aggregations.items() if isinstance(aggregation, dict)}
+    for column, ratio in ratios.items():
+        for base in (ratio["numerator"], ratio["denominator"]):
+            if f"Column.{base}" not in dataframe.columns:
+                raise ValueError(f"{column} is derived from Column.{base}, which is missing from the report")
+    for column in dimensions:
+        if isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+            dataframe[column] = dataframe[column].astype(object)
+
+    result = dataframe.groupby(dimensions, sort=False, dropna=False)[metrics].sum().reset_index()
+    for column, ratio in ratios.items():
+        numerators = result[f"Column.{ratio['numerator']}"].to_numpy(dtype=np.float64) * ratio.get("scale", 1)
+        denominators = result[f"Column.{ratio['denominator']}"].to_numpy(dtype=np.float64)
+        result[column] = np.divide(numerators, denominators, out=np.zeros_like(numerators), where=denominators > 0)
+
+    return result[dimensions + metrics]
+
+
+def convert_report(report_path: PurePath) -> PurePath:
+    """Converts a CSV_DUMP .csv.gz report into a typed, uncompressed (memory-mappable) Feather file next to it."""
+    path = columnar_path(report_path)
+    dataframe = optimize_dtypes(pd.read_csv(report_path, compression="gzip"))
+    feather.write_feather(dataframe, f"{path}.tmp", compression="uncompressed")
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"Report {report_path} converted to {path}")
+    return path
+
+
+class _TeeReader(io.RawIOBase):
+    """Passes a byte stream through, copying everything read to copy and counting it."""
+
+    def __init__(self, stream: BinaryIO, copy: Optional[BinaryIO] = None) -> None:
+        self.stream = stream
+        self.copy = copy
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self.stream.read(len(buffer))
+        if self.copy is not None:
+            self.copy.write(data)
+        buffer[:len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def convert_stream(stream: BinaryIO, report_path: PurePath, archive: bool = True) -> int:
+    """Parses a CSV_DUMP .csv.gz download while it arrives and writes its Feather copy.
+
+    With archive the raw gzip bytes are also kept at report_path. Returns the number of downloaded bytes.
+    """
+    path = columnar_path(report_path)
+    with open(f"{report_path}.tmp", "wb") if archive else io.BytesIO() as raw_file:
+        tee = _TeeReader(stream, raw_file if archive else None)
+        with gzip.GzipFile(fileobj=io.BufferedReader(tee)) as csv_file:
+            dataframe = optimize_dtypes(pd.read_csv(csv_file))
+    feather.write_feather(dataframe, f"{path}.tmp", compression="uncompressed")
+    os.replace(f"{path}.tmp", path)
+    if archive:
+        os.replace(f"{report_path}.tmp", report_path)
+    logger.info(f"Report streamed to {path} ({tee.bytes_read} bytes)")
+    return tee.bytes_read
+
+
+def load_report(report_path: PurePath, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Loads a report from its Feather copy, converting it first if the copy is missing or stale.
+
+    Streamed reports without an archived .csv.gz are read from the Feather copy alone.
+    """
+    path = columnar_path(report_path)
+    if os.path.exists(report_path) and (not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(report_path)):
+        convert_report(report_path)
+    return feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+
+def iter_report_chunks(report_path: PurePath, chunk_size: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """Reads a CSV_DUMP .csv.gz report chunk_size rows at a time, so memory is bounded by the chunk and not the report.
+
+    Streamed reports without an archived .csv.gz are read from the memory-mapped Feather copy in record batches.
+    """
+    if not os.path.exists(report_path):
+        table = feather.read_table(columnar_path(report_path), columns=columns, memory_map=True)
+        for number, batch in enumerate(table.to_batches(max_chunksize=chunk_size), 1):
+            logger.debug(f"Processing batch {number} ({batch.num_rows} rows) of report {columnar_path(report_path)}")
+            yield batch.to_pandas()
+        return
+    with pd.read_csv(report_path, compression="gzip", usecols=columns, chunksize=chunk_size) as reader:
+        for number, chunk in enumerate(reader, 1):
+            logger.debug(f"Processing chunk {number} ({len(chunk)} rows) of report {report_path}")
+            yield optimize_dtypes(chunk)
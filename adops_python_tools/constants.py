@@ -3,6 +3,31 @@ import datetime
 import os
 
 API_VERSION = "v202202"
+# Fetched WSDL/XSD documents never change within an API version, so they are
+# cached on disk per version without expiry.
+WSDL_CACHE_DIR = os.environ.get("WSDL_CACHE_DIR", "/data/cache/wsdl")
+WSDL_CACHE_PATH = os.path.join(WSDL_CACHE_DIR, f"{API_VERSION}.db")
+# Compiled whitelist/blacklist matchers, keyed by list file content hash.
+PATTERN_CACHE_DIR = os.environ.get("PATTERN_CACHE_DIR", "/data/cache/patterns")
+# Upper bound of concurrent page requests for a single PQL statement.
+PAGE_WORKERS = int(os.environ.get("PAGE_WORKERS", 8))
+# Upper bound of networks processed concurrently by AdManagerClientPool.
+NETWORK_WORKERS = int(os.environ.get("NETWORK_WORKERS", 5))
+# Adaptive (AIMD) limit of in-flight Ad Manager API calls per network.
+LIMITER_INITIAL_CONCURRENCY = int(os.environ.get("LIMITER_INITIAL_CONCURRENCY", 4))
+LIMITER_MAX_CONCURRENCY = int(os.environ.get("LIMITER_MAX_CONCURRENCY", 32))
+LIMITER_MAX_ATTEMPTS = int(os.environ.get("LIMITER_MAX_ATTEMPTS", 6))
+# API metrics are written in Prometheus text format for .prom/.txt paths, JSON otherwise.
+METRICS_OUTPUT_PATH = os.environ.get("METRICS_OUTPUT_PATH", "/data/metrics/api_metrics.json")
+# Reports downloaded concurrently, and the longest pause between report job status polls (seconds).
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 4))
+REPORT_POLL_INTERVAL = float(os.environ.get("REPORT_POLL_INTERVAL", 30))
+# Prebid orders built concurrently by prebid_manager.build_prebid_orders.
+PREBID_ORDER_WORKERS = int(os.environ.get("PREBID_ORDER_WORKERS", 6))
+# Rows of a notification table shown inline, longer tables are attached as gzipped CSV.
+HTML_MAX_ROWS = int(os.environ.get("HTML_MAX_ROWS", 500))
+# Maximum number of values bound to a single PQL "IN" clause.
+PQL_IN_CHUNK_SIZE = 500
 # The Ad Manager API OAuth2 and GMAIL scope.
 SCOPES = [
     "https://www.googleapis.com/auth/dfp",
@@ -17,6 +42,10 @@ TODAY = datetime.date.today().strftime("%d-%b-%Y")
 
 DEFAULT_DB_PATH = os.environ["DEFAULT_DB_PATH"]
 DEFAULT_APP_NAME = os.environ["DEFAULT_APP_NAME"]
+# Local mirror of Ad Manager entities, kept next to the credentials database.
+ENTITY_STORE_PATH = os.environ.get("ENTITY_STORE_PATH", os.path.join(os.path.dirname(DEFAULT_DB_PATH), "entities.db"))
+# Incremental syncs miss deleted entities, a full sync of every scope removes them this often.
+ENTITY_STORE_FULL_SYNC_DAYS = int(os.environ.get("ENTITY_STORE_FULL_SYNC_DAYS", 7))
 
 # Your OAuth2 Client ID and Secret. If you do not have an ID and Secret yet,
 # please go to https://console.developers.google.com and create a set.
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+import datetime
+import json
+import logging
+import sqlite3
+from collections import namedtuple
+from typing import List, Optional
+
+import pytz
+from googleads.ad_manager import StatementBuilder
+from zeep.helpers import serialize_object
+
+from adops_ad_manager import AdOpsAdManagerClient
+from constants import API_VERSION, ENTITY_STORE_FULL_SYNC_DAYS, ENTITY_STORE_PATH
+
+logger = logging.getLogger(__name__)
+
+EntityType = namedtuple("EntityType", ["service", "method", "key_fields", "modified_field"])
+
+ENTITY_TYPES = {
+    "ad_unit": EntityType("inventory_service", "getAdUnitsByStatement", ("id",), "lastModifiedDateTime"),
+    "custom_targeting_key": EntityType("custom_targeting_service", "getCustomTargetingKeysByStatement", ("id",), None),
+    "custom_targeting_value": EntityType("custom_targeting_service", "getCustomTargetingValuesByStatement", ("id",), None),
+    "line_item": EntityType("line_item_service", "getLineItemsByStatement", ("id",), "lastModifiedDateTime"),
+    "lica": EntityType(
+        "lica_service", "getLineItemCreativeAssociationsByStatement", ("lineItemId", "creativeId"), "lastModifiedDateTime"
+    ),
+    "company": EntityType("company_service", "getCompaniesByStatement", ("id",), "lastModifiedDateTime"),
+    "site": EntityType("site_service", "getSitesByStatement", ("id",), None),
+}
+
+# Objects modified while the previous sync was paging are picked up again.
+SYNC_OVERLAP = datetime.timedelta(minutes=5)
+
+
+class EntityStore:
+    """Local SQLite mirror of Ad Manager entities, refreshed incrementally by lastModifiedDateTime.
+
+    The database runs in WAL mode so several tool processes can read while one syncs.
+    Every ENTITY_STORE_FULL_SYNC_DAYS a scope is synced in full, which removes the
+    entities Ad Manager no longer returns for it. Use it as a context manager to
+    close the connection.
+    """
+
+    def __init__(self, db_path: str = ENTITY_STORE_PATH) -> None:
+        self.db_path = db_path
+        self.db_connection = sqlite3.connect(self.db_path, timeout=30)
+        self.db_connection.row_factory = sqlite3.Row
+        self.db_connection.execute("PRAGMA journal_mode=WAL")
+        self.create_tables()
+
+    def __enter__(self) -> "EntityStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db_connection.close()
+
+    def create_tables(self) -> None:
+        with self.db_connection:
+            self.db_connection.execute(
+                """CREATE TABLE IF NOT EXISTS entities(
+                    network_code text,
+                    entity_type text,
+                    id text,
+                    name text,
+                    payload text,
+                    synced_at text,
+                    PRIMARY KEY (network_code, entity_type, id)
+                )"""
+            )
+            self.db_connection.execute(
+                "CREATE INDEX IF NOT EXISTS entities_name ON entities(network_code, entity_type, name)"
+            )
+            # Entities returned by the syncs of every scope, for pruning.
+            self.db_connection.execute(
+                """CREATE TABLE IF NOT EXISTS entity_scopes(
+                    network_code text,
+                    entity_type text,
+                    scope text,
+                    id text,
+                    synced_at text,
+                    PRIMARY KEY (network_code, entity_type, scope, id)
+                )"""
+            )
+            self.db_connection.execute(
+                """CREATE TABLE IF NOT EXISTS sync_state(
+                    network_code text,
+                    entity_type text,
+                    scope text,
+                    last_sync text,
+                    PRIMARY KEY (network_code, entity_type, scope)
+                )"""
+            )
+            self.db_connection.execute(
+                """CREATE TABLE IF NOT EXISTS full_sync_state(
+                    network_code text,
+                    entity_type text,
+                    scope text,
+                    last_sync text,
+                    PRIMARY KEY (network_code, entity_type, scope)
+                )"""
+            )
+
+    def last_sync(
+        self, network_code: str, entity_type: str, scope: str, table: str = "sync_state"
+    ) -> Optional[datetime.datetime]:
+        row = self.db_connection.execute(
+            f"SELECT last_sync FROM {table} WHERE network_code = :network_code AND entity_type = :entity_type AND scope = :scope",
+            {"network_code": network_code, "entity_type": entity_type, "scope": scope},
+        ).fetchone()
+        return pytz.utc.localize(datetime.datetime.fromisoformat(row["last_sync"])) if row else None
+
+    def sync(
+        self,
+        client: AdOpsAdManagerClient,
+        entity_type: str,
+        where: str = "",
+        full: bool = False,
+        max_age: Optional[datetime.timedelta] = None,
+    ) -> int:
+        """Stores entities changed since the last sync of the same scope (where) and returns their number.
+
+        Entity types without a modification timestamp are fully refreshed, unless
+        the last sync of the scope is younger than max_age. Full syncs prune the
+        entities they did not return.
+        """
+        spec = ENTITY_TYPES[entity_type]
+        network_code = str(client.current_network["networkCode"])
+        sync_started = datetime.datetime.now(pytz.utc)
+        last_sync = self.last_sync(network_code, entity_type, where)
+        if not full and max_age and last_sync and sync_started - last_sync < max_age:
+            logger.debug(f"{entity_type} entities of network {network_code} are fresh, skipping sync")
+            return 0
+        last_full_sync = self.last_sync(network_code, entity_type, where, "full_sync_state")
+        if not last_full_sync or sync_started - last_full_sync >= datetime.timedelta(days=ENTITY_STORE_FULL_SYNC_DAYS):
+            full = True
+        since = None if full or not spec.modified_field else last_sync
+
+        conditions = [where] if where else []
+        statement = StatementBuilder(version=API_VERSION)
+        if since:
+            conditions.append(f"{spec.modified_field} >= :since")
+            statement.WithBindVariable("since", since - SYNC_OVERLAP)
+        if conditions:
+            statement.Where(" AND ".join(f"({condition})" for condition in conditions))
+
+        callback = getattr(getattr(client, spec.service), spec.method)
+        synced = 0
+        for page in client.iter_pages(statement, callback):
+            self.save(network_code, entity_type, page, sync_started, scope=where)
+            synced += len(page)
+        if not since:
+            self.prune(network_code, entity_type, where, sync_started)
+
+        state = {
+            "network_code": network_code,
+            "entity_type": entity_type,
+            "scope": where,
+            "last_sync": sync_started.replace(tzinfo=None).isoformat(),
+        }
+        with self.db_connection:
+            self.db_connection.execute(
+                "INSERT OR REPLACE INTO sync_state VALUES (:network_code, :entity_type, :scope, :last_sync)", state
+            )
+            if not since:
+                self.db_connection.execute(
+                    "INSERT OR REPLACE INTO full_sync_state VALUES (:network_code, :entity_type, :scope, :last_sync)", state
+                )
+        logger.info(f"Synced {synced} {entity_type} entities of network {network_code} ({'incremental' if since else 'full'})")
+
+        return synced
+
+    def save(
+        self, network_code: str, entity_type: str, items: list, synced_at: datetime.datetime, scope: Optional[str] = None
+    ) -> None:
+        key_fields = ENTITY_TYPES[entity_type].key_fields
+        rows = []
+        for item in items:
+            item = serialize_object(item, dict)
+            rows.append({
+                "network_code": network_code,
+                "entity_type": entity_type,
+                "id": ":".join(str(item[field]) for field in key_fields),
+                "name": item.get("name") or item.get("url"),
+                "payload": json.dumps(item, default=str),
+                "synced_at": synced_at.isoformat(),
+            })
+        with self.db_connection:
+            self.db_connection.executemany(
+                "INSERT OR REPLACE INTO entities VALUES (:network_code, :entity_type, :id, :name, :payload, :synced_at)",
+                rows,
+            )
+            if scope is not None:
+                self.db_connection.executemany(
+                    "INSERT OR REPLACE INTO entity_scopes VALUES (:network_code, :entity_type, :scope, :id, :synced_at)",
+                    [dict(row, scope=scope) for row in rows],
+                )
+
+    def prune(self, network_code: str, entity_type: str, scope: str, synced_at: datetime.datetime) -> int:
+        """Forgets the entities a completed full sync of scope did not return, unless another scope returned them.
+
+        An unscoped sync covers every entity of the type, so it also forgets entities stored by other scopes.
+        """
+        parameters = {
+            "network_code": network_code, "entity_type": entity_type, "scope": scope, "synced_at": synced_at.isoformat()
+        }
+        with self.db_connection:
+            if scope:
+                removed = self.db_connection.execute(
+                    """DELETE FROM entities WHERE network_code = :network_code AND entity_type = :entity_type
+                    AND id IN (
+                        SELECT id FROM entity_scopes WHERE network_code = :network_code AND entity_type = :entity_type
+                        AND scope = :scope AND synced_at < :synced_at
+                    )
+                    AND id NOT IN (
+                        SELECT id FROM entity_scopes WHERE network_code = :network_code AND entity_type = :entity_type
+                        AND (scope != :scope OR synced_at >= :synced_at)
+                    )""",
+                    parameters,
+                ).rowcount
+                self.db_connection.execute(
+                    """DELETE FROM entity_scopes WHERE network_code = :network_code AND entity_type = :entity_type
+                    AND scope = :scope AND synced_at < :synced_at""",
+                    parameters,
+                )
+            else:
+                removed = self.db_connection.execute(
+                    """DELETE FROM entities WHERE network_code = :network_code AND entity_type = :entity_type
+                    AND synced_at < :synced_at""",
+                    parameters,
+                ).rowcount
+                self.db_connection.execute(
+                    """DELETE FROM entity_scopes WHERE network_code = :network_code AND entity_type = :entity_type
+                    AND id NOT IN (
+                        SELECT id FROM entities WHERE network_code = :network_code AND entity_type = :entity_type
+                    )""",
+                    parameters,
+                )
+        if removed:
+            logger.info(f"Removed {removed} {entity_type} entities of network {network_code} no longer in Ad Manager")
+        return removed
+
+    def get(self, network_code: str, entity_type: str, entity_id) -> Optional[dict]:
+        row = self.db_connection.execute(
+            "SELECT payload FROM entities WHERE network_code = :network_code AND entity_type = :entity_type AND id = :id",
+            {"network_code": str(network_code), "entity_type": entity_type, "id": str(entity_id)},
+        ).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def find(self, network_code: str, entity_type: str, **fields) -> List[dict]:
+        """Returns stored entities whose payload fields equal the given values, e.g. find(code, "site", url="a.pl")."""
+        query = "SELECT payload FROM entities WHERE network_code = ? AND entity_type = ?"
+        parameters = [str(network_code), entity_type]
+        for field, value in fields.items():
+            if field == "name":
+                query += " AND name = ?"
+            else:
+                query += f" AND json_extract(payload, '$.{field}') = ?"
+            parameters.append(value)
+        return [json.loads(row["payload"]) for row in self.db_connection.execute(query, parameters)]
+
+    def all(self, network_code: str, entity_type: str) -> List[dict]:
+        return self.find(network_code, entity_type)
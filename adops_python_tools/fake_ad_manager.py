@@ -0,0 +1,696 @@
+#!/usr/bin/env python
+"""In-memory stand-in for the Ad Manager services used by AdOpsAdManagerClient.
+
+Point a client at it with fake_ad_manager_client(FakeNetwork(...)) to run the
+tools offline, e.g. to benchmark pagination, batching and concurrency.
+"""
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from copy import deepcopy
+from typing import Dict, List, Optional
+
+import pytz
+from googleads.errors import GoogleAdsServerFault
+
+from adops_ad_manager import AdOpsAdManagerClient
+
+logger = logging.getLogger(__name__)
+
+_TOKENS = re.compile(
+    r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<bind>:\w+)|(?P<number>-?\d+(?:\.\d+)?)"
+    r"|(?P<operator>!=|>=|<=|=|<|>)|(?P<punctuation>[(),])|(?P<word>[A-Za-z_][\w.]*))"
+)
+_CLAUSES = re.compile(
+    r"^\s*(?:WHERE\s+(?P<where>.*?))?\s*(?:ORDER BY\s+(?P<order>\w+)(?:\s+(?P<direction>ASC|DESC))?)?"
+    r"\s*(?:LIMIT\s+(?P<limit>\d+))?\s*(?:OFFSET\s+(?P<offset>\d+))?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def server_fault(error_string: str, trigger: str = "", field_path: str = "", reason: str = "") -> GoogleAdsServerFault:
+    error = {
+        "errorString": error_string,
+        "reason": reason or error_string.split(".")[-1],
+        "trigger": trigger,
+        "fieldPath": field_path,
+    }
+    return GoogleAdsServerFault(None, errors=[error], message=f"[{error_string} @ {field_path}; trigger:'{trigger}']")
+
+
+def bind_value(value: dict):
+    if value.get("xsi_type") == "SetValue":
+        return [bind_value(item) for item in value.get("values", [])]
+    if value.get("xsi_type") == "DateTimeValue":
+        date_time = value["value"]
+        return pytz.timezone(date_time.get("timeZoneId") or "UTC").localize(datetime.datetime(
+            date_time["date"]["year"], date_time["date"]["month"], date_time["date"]["day"],
+            date_time.get("hour", 0), date_time.get("minute", 0), date_time.get("second", 0),
+        ))
+    if value.get("xsi_type") == "DateValue":
+        return datetime.date(value["value"]["year"], value["value"]["month"], value["value"]["day"])
+    return value.get("value")
+
+
+class PqlStatement:
+    """Parses the PQL subset produced by StatementBuilder and the tools: AND/OR, parentheses,
+    comparisons, IN and LIKE, ORDER BY, LIMIT and OFFSET."""
+
+    def __init__(self, statement: dict) -> None:
+        match = _CLAUSES.match(statement.get("query", ""))
+        if not match:
+            raise server_fault("PQLError.SYNTAX_ERROR", statement.get("query", ""))
+        self.values = {item["key"]: bind_value(item["value"]) for item in statement.get("values") or []}
+        self.order = match.group("order")
+        self.descending = (match.group("direction") or "ASC").upper() == "DESC"
+        self.limit = int(match.group("limit") or 500)
+        self.offset = int(match.group("offset") or 0)
+        self.tokens = [
+            (kind, value)
+            for token in _TOKENS.finditer(match.group("where") or "")
+            for kind, value in token.groupdict().items() if value is not None
+        ]
+        self.position = 0
+        self.condition = self.parse_or() if self.tokens else (lambda entity: True)
+
+    def peek(self, word: Optional[str] = None):
+        if self.position >= len(self.tokens):
+            return None
+        token = self.tokens[self.position]
+        if word is not None and token[1].upper() != word:
+            return None
+        return token
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse_or(self):
+        conditions = [self.parse_and()]
+        while self.peek("OR"):
+            self.take()
+            conditions.append(self.parse_and())
+        return lambda entity: any(condition(entity) for condition in conditions)
+
+    def parse_and(self):
+        conditions = [self.parse_factor()]
+        while self.peek("AND"):
+            self.take()
+            conditions.append(self.parse_factor())
+        return lambda entity: all(condition(entity) for condition in conditions)
+
+    def parse_factor(self):
+        if self.peek("("):
+            self.take()
+            condition = self.parse_or()
+            self.take()
+            return condition
+        if self.peek("NOT"):
+            self.take()
+            condition = self.parse_factor()
+            return lambda entity: not condition(entity)
+        return self.parse_condition()
+
+    def parse_value(self):
+        kind, value = self.take()
+        if kind == "string":
+            return value[1:-1].replace("''", "'")
+        if kind == "bind":
+            return self.values[value[1:]]
+        if kind == "number":
+            return float(value) if "." in value else int(value)
+        return value
+
+    def parse_condition(self):
+        field = self.take()[1]
+        if self.peek("IN"):
+            self.take()
+            self.take()
+            options = []
+            while not self.peek(")"):
+                value = self.parse_value()
+                options.extend(value if isinstance(value, list) else [value])
+                if self.peek(","):
+                    self.take()
+            self.take()
+            options = {normalize(option) for option in options}
+            return lambda entity: normalize(field_value(entity, field)) in options
+        if self.peek("LIKE"):
+            self.take()
+            pattern = re.compile(
+                "^" + ".*".join(re.escape(part) for part in str(self.parse_value()).split("%")) + "$", re.IGNORECASE
+            )
+            return lambda entity: bool(pattern.match(str(field_value(entity, field) or "")))
+        operator = self.take()[1]
+        expected = normalize(self.parse_value())
+        compare = {
+            "=": lambda a, b: a == b,
+            "!=": lambda a, b: a != b,
+            ">": lambda a, b: a is not None and a > b,
+            ">=": lambda a, b: a is not None and a >= b,
+            "<": lambda a, b: a is not None and a < b,
+            "<=": lambda a, b: a is not None and a <= b,
+        }[operator]
+        return lambda entity: compare(normalize(field_value(entity, field)), expected)
+
+    def select(self, entities: List[dict]) -> dict:
+        matching = [entity for entity in entities if self.condition(entity)]
+        if self.order:
+            matching.sort(key=lambda entity: sort_key(field_value(entity, self.order)), reverse=self.descending)
+        return {
+            "startIndex": self.offset,
+            "totalResultSetSize": len(matching),
+            "results": [deepcopy(entity) for entity in matching[self.offset:self.offset + self.limit]],
+        }
+
+
+def field_value(entity: dict, field: str):
+    value = entity
+    for part in field.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def normalize(value):
+    if isinstance(value, str) and re.fullmatch(r"-?\d+", value):
+        return int(value)
+    return "" if value is None else value
+
+
+def sort_key(value):
+    value = normalize(value)
+    return (0, value, "") if isinstance(value, (int, float)) else (1, 0, str(value))
+
+
+FAKE_REPORT_URL = "https://fake.example.com/reports/"
+
+
+class FakeNetwork:
+    """Shared in-memory state and fault injection of a fake Ad Manager network.
+
+    latency: seconds added to every call (plus up to 50% jitter).
+    quota_error_rate: probability of QuotaError.EXCEEDED_QUOTA per call.
+    max_concurrency: calls above this many in flight fail with QuotaError.EXCEEDED_QUOTA.
+    report_duration: seconds a report job runs before it is COMPLETED.
+    report_failure_rate: probability of a report job ending FAILED.
+    """
+
+    def __init__(
+        self,
+        network_code: str = "123456789",
+        latency: float = 0.0,
+        quota_error_rate: float = 0.0,
+        max_concurrency: Optional[int] = None,
+        report_duration: float = 0.0,
+        report_failure_rate: float = 0.0,
+        time_zone: str = "Europe/Warsaw",
+        seed: int = 0,
+    ) -> None:
+        self.network_code = network_code
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self.max_concurrency = max_concurrency
+        self.report_duration = report_duration
+        self.report_failure_rate = report_failure_rate
+        self.time_zone = time_zone
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.in_flight = 0
+        self.ids = itertools.count(1000000)
+        self.entities: Dict[str, List[dict]] = {
+            entity_type: []
+            for entity_type in (
+                "ad_unit", "placement", "line_item", "lica", "order", "creative",
+                "custom_targeting_key", "custom_targeting_value", "company", "site", "user",
+            )
+        }
+        self.root_ad_unit = self.add("ad_unit", {"name": "root", "adUnitCode": network_code, "status": "ACTIVE", "parentPath": []})
+        self.user = self.add("user", {"name": "Fake User", "email": "fake.user@example.com"})
+        self.report_jobs: Dict[int, dict] = {}
+        self.report_completion: Dict[int, float] = {}
+        self.failed_report_jobs = set()
+
+    def next_id(self) -> int:
+        return next(self.ids)
+
+    def run_report_job(self, report_job: dict) -> int:
+        with self.lock:
+            report_job_id = self.next_id()
+            self.report_jobs[report_job_id] = deepcopy(report_job)
+            self.report_completion[report_job_id] = time.monotonic() + self.report_duration
+            if self.random.random() < self.report_failure_rate:
+                self.failed_report_jobs.add(report_job_id)
+        return report_job_id
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now(pytz.utc)
+
+    def add(self, entity_type: str, entity: dict) -> dict:
+        with self.lock:
+            entity = dict(entity)
+            if entity_type != "lica":
+                entity.setdefault("id", self.next_id())
+            entity["lastModifiedDateTime"] = self.now()
+            self.entities[entity_type].append(entity)
+            return entity
+
+    def populate(self, ad_units: int = 1000, placements: int = 10, hb_pb_values: int = 2000, companies: int = 20) -> "FakeNetwork":
+        """Fills the network with realistic looking inventory and Prebid key-values."""
+        for index in range(ad_units):
+            self.add("ad_unit", {
+                "name": f"ad_unit_{index}",
+                "adUnitCode": f"ad_unit_{index}",
+                "status": "ACTIVE",
+                "parentId": self.root_ad_unit["id"],
+                "parentPath": [{"id": self.root_ad_unit["id"], "adUnitCode": self.root_ad_unit["adUnitCode"]}],
+            })
+        ad_unit_ids = [str(ad_unit["id"]) for ad_unit in self.entities["ad_unit"][1:]]
+        for index in range(placements):
+            self.add("placement", {
+                "name": f"placement_{index}",
+                "status": "ACTIVE",
+                "targetedAdUnitIds": self.random.sample(ad_unit_ids, min(len(ad_unit_ids), 50)),
+            })
+        hb_pb = self.add("custom_targeting_key", {"name": "hb_pb", "displayName": "hb_pb", "type": "PREDEFINED"})
+        for cents in range(1, hb_pb_values + 1):
+            self.add("custom_targeting_value", {
+                "customTargetingKeyId": hb_pb["id"], "name": f"{cents / 100:.2f}", "matchType": "EXACT", "status": "ACTIVE",
+            })
+        hb_format = self.add("custom_targeting_key", {"name": "hb_format", "displayName": "hb_format", "type": "PREDEFINED"})
+        for name in ("banner", "video", "native"):
+            self.add("custom_targeting_value", {
+                "customTargetingKeyId": hb_format["id"], "name": name, "matchType": "EXACT", "status": "ACTIVE",
+            })
+        self.add("company", {"name": "Prebid", "type": "ADVERTISER"})
+        for index in range(companies):
+            company = self.add("company", {
+                "name": f"Publisher {index}",
+                "email": f"publisher{index}@example.com",
+                "type": "CHILD_PUBLISHER",
+                "childPublisher": {"status": "APPROVED", "accountStatus": "APPROVED", "childNetworkCode": str(900000 + index)},
+            })
+            self.add("site", {
+                "url": f"publisher{index}.example.com",
+                "childNetworkCode": company["childPublisher"]["childNetworkCode"],
+                "approvalStatus": "APPROVED",
+            })
+        return self
+
+    def call(self, method: str) -> "_FakeCall":
+        return _FakeCall(self, method)
+
+
+class _FakeCall:
+    def __init__(self, network: FakeNetwork, method: str) -> None:
+        self.network = network
+        self.method = method
+
+    def __enter__(self):
+        network = self.network
+        with network.lock:
+            network.in_flight += 1
+            over_limit = network.max_concurrency is not None and network.in_flight > network.max_concurrency
+            quota_error = over_limit or network.random.random() < network.quota_error_rate
+        if network.latency:
+            time.sleep(network.latency * (1 + network.random.random() / 2))
+        if quota_error:
+            self.__exit__(None, None, None)
+            raise server_fault("QuotaError.EXCEEDED_QUOTA", trigger=self.method)
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.network.lock:
+            self.network.in_flight -= 1
+
+
+class FakeService:
+    """Base of the fake services. Subclasses map getXByStatement/createX/updateX to entity types."""
+
+    entity_type = ""
+    unique_fields = ()
+
+    def __init__(self, network: FakeNetwork) -> None:
+        self.network = network
+
+    def get_by_statement(self, statement: dict, entity_type: Optional[str] = None) -> dict:
+        with self.network.call("get"):
+            with self.network.lock:
+                return PqlStatement(statement).select(self.network.entities[entity_type or self.entity_type])
+
+    def unique_key(self, entity: dict, unique_fields: Optional[tuple] = None):
+        return tuple(normalize(field_value(entity, field)) for field in unique_fields or self.unique_fields)
+
+    def create(self, entities, entity_type: Optional[str] = None, unique_fields: Optional[tuple] = None) -> List[dict]:
+        entities = entities if isinstance(entities, list) else [entities]
+        entity_type = entity_type or self.entity_type
+        unique_fields = unique_fields or self.unique_fields
+        with self.network.call("create"):
+            with self.network.lock:
+                if unique_fields:
+                    existing = {self.unique_key(entity, unique_fields) for entity in self.network.entities[entity_type]}
+                    for entity in entities:
+                        key = self.unique_key(entity, unique_fields)
+                        if key in existing:
+                            field = unique_fields[-1]
+                            raise server_fault("UniqueError.NOT_UNIQUE", trigger=str(field_value(entity, field)), field_path=field)
+                        existing.add(key)
+                return [deepcopy(self.network.add(entity_type, self.defaults(entity))) for entity in entities]
+
+    def defaults(self, entity: dict) -> dict:
+        return entity
+
+    def update(self, entities: List[dict]) -> List[dict]:
+        with self.network.call("update"):
+            with self.network.lock:
+                stored = self.network.entities[self.entity_type]
+                index = {self.identity(entity): position for position, entity in enumerate(stored)}
+                updated = []
+                for entity in entities:
+                    position = index.get(self.identity(entity))
+                    if position is None:
+                        raise server_fault("EntityNotFoundError.NOT_FOUND", trigger=str(self.identity(entity)))
+                    entity = deepcopy(entity)
+                    entity["lastModifiedDateTime"] = self.network.now()
+                    stored[position] = entity
+                    updated.append(deepcopy(entity))
+                return updated
+
+    def identity(self, entity: dict):
+        return normalize(entity["id"])
+
+    def perform_action(self, action: dict, statement: dict, changes: dict) -> dict:
+        with self.network.call("perform"):
+            with self.network.lock:
+                query = PqlStatement(statement)
+                changed = 0
+                for entity in self.network.entities[self.entity_type]:
+                    if query.condition(entity) and any(entity.get(key) != value for key, value in changes.items()):
+                        entity.update(changes)
+                        entity["lastModifiedDateTime"] = self.network.now()
+                        changed += 1
+                return {"numChanges": changed}
+
+
+class FakeInventoryService(FakeService):
+    entity_type = "ad_unit"
+
+    def getAdUnitsByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def performAdUnitAction(self, action, statement):
+        status = {"ArchiveAdUnits": "ARCHIVED", "ActivateAdUnits": "ACTIVE", "DeactivateAdUnits": "INACTIVE"}
+        return self.perform_action(action, statement, {"status": status[action["xsi_type"]]})
+
+
+class FakePlacementService(FakeService):
+    entity_type = "placement"
+    unique_fields = ("name",)
+
+    def getPlacementsByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createPlacements(self, placements):
+        return self.create(placements)
+
+    def updatePlacements(self, placements):
+        return self.update(placements)
+
+
+class FakeOrderService(FakeService):
+    entity_type = "order"
+    unique_fields = ("name",)
+
+    def getOrdersByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createOrders(self, orders):
+        return self.create(orders)
+
+    def defaults(self, order):
+        return {"status": "DRAFT", "isArchived": False, **order}
+
+
+class FakeLineItemService(FakeService):
+    entity_type = "line_item"
+    unique_fields = ("orderId", "name")
+
+    def getLineItemsByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createLineItems(self, line_items):
+        return self.create(line_items)
+
+    def updateLineItems(self, line_items):
+        return self.update(line_items)
+
+    def defaults(self, line_item):
+        return {"status": "READY", "isArchived": False, **line_item}
+
+
+class FakeLineItemCreativeAssociationService(FakeService):
+    entity_type = "lica"
+    unique_fields = ("lineItemId", "creativeId")
+
+    def getLineItemCreativeAssociationsByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createLineItemCreativeAssociations(self, licas):
+        return self.create(licas)
+
+    def updateLineItemCreativeAssociations(self, licas):
+        return self.update(licas)
+
+    def identity(self, lica):
+        return self.unique_key(lica)
+
+    def defaults(self, lica):
+        return {"status": "ACTIVE", "sizes": [], **lica}
+
+
+class FakeCreativeService(FakeService):
+    entity_type = "creative"
+
+    def getCreativesByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createCreatives(self, creatives):
+        return self.create(creatives)
+
+
+class FakeCustomTargetingService(FakeService):
+    def getCustomTargetingKeysByStatement(self, statement):
+        return self.get_by_statement(statement, "custom_targeting_key")
+
+    def getCustomTargetingValuesByStatement(self, statement):
+        return self.get_by_statement(statement, "custom_targeting_value")
+
+    def createCustomTargetingKeys(self, keys):
+        return self.create(keys, "custom_targeting_key", ("name",))
+
+    def createCustomTargetingValues(self, values):
+        return self.create(values, "custom_targeting_value", ("customTargetingKeyId", "name"))
+
+
+class FakeCompanyService(FakeService):
+    entity_type = "company"
+    unique_fields = ("name",)
+
+    def getCompaniesByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createCompanies(self, companies):
+        return self.create(companies)
+
+    def defaults(self, company):
+        if company.get("type") == "CHILD_PUBLISHER":
+            company = deepcopy(company)
+            company["childPublisher"].update({"status": "PENDING_GOOGLE_APPROVAL", "accountStatus": "PENDING_INVITE"})
+        return company
+
+
+class FakeSiteService(FakeService):
+    entity_type = "site"
+    unique_fields = ("url",)
+
+    def getSitesByStatement(self, statement):
+        return self.get_by_statement(statement)
+
+    def createSites(self, sites):
+        try:
+            return self.create(sites)
+        except GoogleAdsServerFault as error:
+            url = error.errors[0]["trigger"]
+            raise server_fault("UniqueError.ALREADY_EXISTS", trigger=url, field_path="url", reason="ALREADY_EXISTS")
+
+    def defaults(self, site):
+        return {"approvalStatus": "DRAFT", **site}
+
+    def performSiteAction(self, action, statement):
+        return self.perform_action(action, statement, {"approvalStatus": "UNCHECKED"})
+
+
+class FakeNetworkService(FakeService):
+    def network_info(self) -> dict:
+        return {
+            "id": 1,
+            "networkCode": self.network.network_code,
+            "displayName": f"Fake network {self.network.network_code}",
+            "timeZone": self.network.time_zone,
+            "currencyCode": "EUR",
+            "effectiveRootAdUnitId": str(self.network.root_ad_unit["id"]),
+        }
+
+    def getCurrentNetwork(self):
+        with self.network.call("getCurrentNetwork"):
+            return self.network_info()
+
+    def getAllNetworks(self):
+        with self.network.call("getAllNetworks"):
+            return [self.network_info()]
+
+
+class FakeUserService(FakeService):
+    def getCurrentUser(self):
+        with self.network.call("getCurrentUser"):
+            return deepcopy(self.network.user)
+
+
+class FakeReportService(FakeService):
+    def runReportJob(self, report_job):
+        with self.network.call("runReportJob"):
+            report_job_id = self.network.run_report_job(report_job)
+            return {"id": report_job_id, **deepcopy(report_job)}
+
+    def getReportJobStatus(self, report_job_id):
+        with self.network.call("getReportJobStatus"):
+            if report_job_id not in self.network.report_jobs:
+                raise server_fault("ReportError.REPORT_NOT_FOUND", trigger=str(report_job_id))
+            if report_job_id in self.network.failed_report_jobs:
+                return "FAILED"
+            return "COMPLETED" if time.monotonic() >= self.network.report_completion[report_job_id] else "IN_PROGRESS"
+
+    def getReportDownloadUrlWithOptions(self, report_job_id, report_download_options):
+        with self.network.call("getReportDownloadUrlWithOptions"):
+            return f"{FAKE_REPORT_URL}{report_job_id}"
+
+
+class FakeDataDownloader:
+    """Generates CSV_DUMP reports from the ad units of the fake network."""
+
+    def __init__(self, network: FakeNetwork, urls: int = 20) -> None:
+        self.network = network
+        self.urls = [f"site{index}.example.com" for index in range(urls)]
+
+    def WaitForReport(self, report_job: dict) -> int:
+        with self.network.call("WaitForReport"):
+            report_job_id = self.network.run_report_job(report_job)
+            time.sleep(self.network.report_duration)
+            return report_job_id
+
+    def report_rows(self, report_query: dict):
+        generator = random.Random(str(report_query))
+        ad_units = [ad_unit for ad_unit in self.network.entities["ad_unit"][1:]]
+        dimensions = report_query.get("dimensions", [])
+        columns = report_query.get("columns", [])
+        end_date = report_query.get("endDate")
+        if not isinstance(end_date, datetime.date):
+            end_date = datetime.date.today() - datetime.timedelta(1)
+        start_date = report_query.get("startDate")
+        # A date dimension splits the range into daily rows, otherwise the range is a single row.
+        if not isinstance(start_date, datetime.date) or "AD_EXCHANGE_DATE" not in dimensions:
+            start_date = end_date
+        dates = [start_date + datetime.timedelta(day) for day in range((end_date - start_date).days + 1)]
+        for date, ad_unit in itertools.product(dates, ad_units):
+            for url in generator.sample(self.urls, min(3, len(self.urls))):
+                values = {
+                    "AD_EXCHANGE_DATE": str(date),
+                    "AD_EXCHANGE_URL": url,
+                    "AD_EXCHANGE_DFP_AD_UNIT": ad_unit["name"],
+                    "AD_EXCHANGE_DFP_AD_UNIT_ID": ad_unit["id"],
+                    "AD_EXCHANGE_PRODUCT_NAME": generator.choice(["Display", "Video"]),
+                }
+                row = [values.get(dimension, "") for dimension in dimensions]
+                ad_requests = generator.randint(100, 200000)
+                measurable = generator.randint(0, ad_requests)
+                viewable = generator.randint(0, measurable)
+                clicks = generator.randint(0, ad_requests // 100)
+                revenue = generator.randint(0, 5000 * ad_requests)
+                # Rates are derived from the base metrics, so merged shards can be checked against whole ranges.
+                metrics = {
+                    "AD_EXCHANGE_AD_REQUESTS": ad_requests,
+                    "AD_EXCHANGE_COVERAGE": round(generator.random(), 4),
+                    "AD_EXCHANGE_ACTIVE_VIEW_VIEWABLE_IMPRESSIONS": viewable,
+                    "AD_EXCHANGE_ACTIVE_VIEW_MEASURABLE_IMPRESSIONS": measurable,
+                    "AD_EXCHANGE_ACTIVE_VIEW_VIEWABLE": round(viewable / measurable, 4) if measurable else 0,
+                    "AD_EXCHANGE_CLICKS": clicks,
+                    "AD_EXCHANGE_AD_REQUEST_CTR": round(clicks / ad_requests, 6),
+                    "AD_EXCHANGE_ESTIMATED_REVENUE": revenue,
+                    "AD_EXCHANGE_AD_REQUEST_ECPM": revenue * 1000 // ad_requests,
+                }
+                yield row + [metrics.get(column, generator.random()) for column in columns]
+
+    def report_bytes(self, report_job_id) -> bytes:
+        report_query = self.network.report_jobs[report_job_id]["reportQuery"]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(
+            [f"Dimension.{dimension}" for dimension in report_query.get("dimensions", [])]
+            + [f"Column.{column}" for column in report_query.get("columns", [])]
+        )
+        writer.writerows(self.report_rows(report_query))
+        return gzip.compress(buffer.getvalue().encode())
+
+    def DownloadReportToFile(self, report_job_id, export_format, outfile, **kwargs) -> None:
+        with self.network.call("DownloadReportToFile"):
+            outfile.write(self.report_bytes(report_job_id))
+
+    @property
+    def url_opener(self) -> "FakeDataDownloader":
+        return self
+
+    def open(self, url: str) -> io.BytesIO:
+        """Stands in for url_opener.open on the URLs of FakeReportService.getReportDownloadUrlWithOptions."""
+        with self.network.call("open"):
+            return io.BytesIO(self.report_bytes(int(url[len(FAKE_REPORT_URL):])))
+
+
+class FakeAdManagerClient:
+    """Mimics googleads.ad_manager.AdManagerClient.GetService/GetDataDownloader."""
+
+    SERVICES = {
+        "NetworkService": FakeNetworkService,
+        "PlacementService": FakePlacementService,
+        "InventoryService": FakeInventoryService,
+        "CustomTargetingService": FakeCustomTargetingService,
+        "SiteService": FakeSiteService,
+        "CompanyService": FakeCompanyService,
+        "CreativeService": FakeCreativeService,
+        "UserService": FakeUserService,
+        "OrderService": FakeOrderService,
+        "LineItemService": FakeLineItemService,
+        "LineItemCreativeAssociationService": FakeLineItemCreativeAssociationService,
+        "ReportService": FakeReportService,
+    }
+
+    def __init__(self, network: FakeNetwork) -> None:
+        self.network = network
+        self.network_code = network.network_code
+
+    def GetService(self, service_name: str, version: Optional[str] = None, server: Optional[str] = None):
+        return self.SERVICES[service_name](self.network)
+
+    def GetDataDownloader(self, version: Optional[str] = None, server: Optional[str] = None):
+        return FakeDataDownloader(self.network)
+
+
+def fake_ad_manager_client(network: Optional[FakeNetwork] = None, email: str = "fake.user@example.com") -> AdOpsAdManagerClient:
+    network = network or FakeNetwork().populate()
+    return AdOpsAdManagerClient(email, network.network_code, ad_manager_client=FakeAdManagerClient(network))
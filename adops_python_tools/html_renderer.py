@@ -0,0 +1,54 @@
+import gzip
+from typing import Dict, Optional, Union
+
+import pandas as pd
+import pandas.io.formats.style
+from jinja2 import Environment
+from markupsafe import Markup
+
+from constants import HTML_MAX_ROWS
+
+STYLE = (
+    "h2 {text-align: center;font-family: Helvetica, Arial, sans-serif;}"
+    "table, th, td {border: 1px solid black;border-collapse: collapse;}"
+    "th, td {padding: 1px;text-align: left;font-family: Helvetica, Arial, sans-serif;font-size: 90%;}"
+    "table tbody tr:hover {background-color: #dddddd;}"
+    ".wide {width: 35%;}"
+)
+
+# Compiled once, rows are streamed from itertuples by Template.generate.
+TABLE_TEMPLATE = Environment(autoescape=True).from_string(
+    "<html><head><style>{{ style }}</style></head><body>"
+    "{%- if body %}{{ body }}{% else -%}"
+    '<table border="1" class="dataframe wide"><thead><tr style="text-align: right;"><th></th>'
+    "{%- for column in columns %}<th>{{ column }}</th>{% endfor %}</tr></thead><tbody>"
+    "{%- for row in rows %}<tr><th>{{ row[0] }}</th>{% for value in row[1:] %}<td>{{ value }}</td>{% endfor %}</tr>{% endfor -%}"
+    "</tbody></table>"
+    "{%- if total > shown %}<p>Wyświetlono {{ shown }} z {{ total }} wierszy, pełna tabela w załączniku (CSV).</p>{% endif -%}"
+    "{% endif %}</body></html>"
+)
+
+
+def dataframe_to_html(dataframe: Union[pd.DataFrame, pandas.io.formats.style.Styler, None], max_rows: int = HTML_MAX_ROWS) -> Optional[str]:
+    """HTML e-mail table of at most max_rows rows, with a summary line when the dataframe is longer."""
+    if dataframe is None:
+        return None
+    if isinstance(dataframe, pandas.io.formats.style.Styler):
+        return "".join(TABLE_TEMPLATE.generate(style=STYLE, body=Markup(dataframe.to_html())))
+
+    rows = dataframe.head(max_rows)
+    return "".join(TABLE_TEMPLATE.generate(
+        style=STYLE,
+        body=None,
+        columns=rows.columns,
+        rows=rows.itertuples(name=None),
+        shown=len(rows),
+        total=len(dataframe),
+    ))
+
+
+def csv_attachment(dataframe: Optional[pd.DataFrame], name: str, max_rows: int = HTML_MAX_ROWS) -> Dict[str, bytes]:
+    """Gzipped CSV of the whole dataframe, for tables dataframe_to_html shortens. Empty otherwise."""
+    if dataframe is None or len(dataframe) <= max_rows:
+        return {}
+    return {f"{name}.csv.gz": gzip.compress(dataframe.to_csv().encode())}
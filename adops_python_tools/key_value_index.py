@@ -0,0 +1,116 @@
+import datetime
+import logging
+from typing import Dict, Iterable, List, Optional
+
+import pytz
+from googleads.errors import GoogleAdsServerFault
+
+from adops_ad_manager import AdOpsAdManagerClient
+from entity_store import EntityStore
+from helpers import item_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class KeyValueIndex:
+    """Custom targeting keys and their values by name, loaded once per run.
+
+    Lookups are dictionary reads. A missing key or value raises KeyError instead
+    of silently targeting nothing.
+    """
+
+    def __init__(self, keys: Iterable[dict], values: Iterable[dict], store_path: Optional[str] = None) -> None:
+        self.keys: Dict[str, int] = {key["name"]: key["id"] for key in keys}
+        self.values: Dict[int, Dict[str, int]] = {key_id: {} for key_id in self.keys.values()}
+        for value in values:
+            self.values.setdefault(value["customTargetingKeyId"], {})[value["name"]] = value["id"]
+        # Created values are written back to the entity store, so it does not go stale until its next sync.
+        self.store_path = store_path
+
+    @classmethod
+    def load(cls, client: AdOpsAdManagerClient, key_names: List[str]) -> "KeyValueIndex":
+        keys = client.get_items_by_values("name", key_names, client.custom_targeting_service.getCustomTargetingKeysByStatement)
+        values = []
+        if keys:
+            statement = client.build_statement("customTargetingKeyId", [key["id"] for key in keys])
+            values = client.get_items_by_statement(
+                statement, client.custom_targeting_service.getCustomTargetingValuesByStatement, parallel=True
+            )
+        index = cls(keys, values)
+        logger.info(f"Indexed {len(values)} values of custom targeting keys {', '.join(index.keys)}")
+        return index
+
+    @classmethod
+    def from_store(cls, client: AdOpsAdManagerClient, key_names: List[str], max_age: datetime.timedelta) -> "KeyValueIndex":
+        network_code = str(client.current_network["networkCode"])
+        names = ", ".join(f"'{name}'" for name in key_names)
+        with EntityStore() as store:
+            store.sync(client, "custom_targeting_key", f"name IN ({names})", max_age=max_age)
+            keys = [key for name in key_names for key in store.find(network_code, "custom_targeting_key", name=name)]
+            values = []
+            if keys:
+                key_ids = ", ".join(str(key["id"]) for key in keys)
+                store.sync(client, "custom_targeting_value", f"customTargetingKeyId IN ({key_ids})", max_age=max_age)
+                for key in keys:
+                    values.extend(store.find(network_code, "custom_targeting_value", customTargetingKeyId=key["id"]))
+        return cls(keys, values, store.db_path)
+
+    def key_id(self, key_name: str) -> int:
+        try:
+            return self.keys[key_name]
+        except KeyError:
+            raise KeyError(f"Custom targeting key {key_name} does not exist") from None
+
+    def values_of(self, key_name: str) -> Dict[str, int]:
+        return self.values[self.key_id(key_name)]
+
+    def value_id(self, key_name: str, value_name: str) -> int:
+        try:
+            return self.values_of(key_name)[value_name]
+        except KeyError:
+            raise KeyError(f"Custom targeting value {key_name}={value_name} does not exist") from None
+
+    def missing_values(self, key_name: str, value_names: Iterable[str]) -> List[str]:
+        values = self.values_of(key_name)
+        return [name for name in dict.fromkeys(value_names) if name not in values]
+
+    def ensure_values(self, client: AdOpsAdManagerClient, key_name: str, value_names: Iterable[str], chunk_size: int = 200) -> List[str]:
+        """Creates the values of key_name missing from the index in batched calls, returns their names."""
+        missing = self.missing_values(key_name, value_names)
+        if not missing:
+            return []
+        key_id = self.key_id(key_name)
+        logger.info(f"Creating {len(missing)} missing values of custom targeting key {key_name}")
+        for chunk in item_chunks(missing, chunk_size):
+            # A NOT_UNIQUE value rejects the whole batch, so existing values are re-read and the rest created again.
+            for _ in range(3):
+                names = self.missing_values(key_name, chunk)
+                if not names:
+                    break
+                values = [
+                    {"customTargetingKeyId": key_id, "name": name, "displayName": name, "matchType": "EXACT"} for name in names
+                ]
+                try:
+                    created = client.custom_targeting_service.createCustomTargetingValues(values)
+                except GoogleAdsServerFault as error:
+                    if not any(e["errorString"] == "UniqueError.NOT_UNIQUE" for e in error.errors):
+                        raise
+                    # Created by someone else since the index was loaded.
+                    logger.warning(f"Values of custom targeting key {key_name} already exist, reloading them")
+                    statement = client.build_statement("name", names)
+                    statement.Where("customTargetingKeyId = :customTargetingKeyId AND name IN (:name)")
+                    statement.WithBindVariable("customTargetingKeyId", key_id)
+                    created = client.get_items_by_statement(
+                        statement, client.custom_targeting_service.getCustomTargetingValuesByStatement
+                    )
+                for value in created:
+                    self.values[key_id][value["name"]] = value["id"]
+                if self.store_path and created:
+                    network_code = str(client.current_network["networkCode"])
+                    with EntityStore(self.store_path) as store:
+                        store.save(network_code, "custom_targeting_value", created, datetime.datetime.now(pytz.utc))
+
+        if still_missing := self.missing_values(key_name, missing):
+            raise KeyError(f"Custom targeting values {key_name}={', '.join(still_missing)} could not be created")
+
+        return missing
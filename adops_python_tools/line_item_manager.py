@@ -1,4 +1,5 @@
 import logging
+import sys
 
 from googleads import ad_manager
 
@@ -9,7 +10,51 @@ from helpers import item_chunks
 logger = logging.getLogger(__name__)
 
 
-def update_line_items(client, order_id):
+SIZES = [(360, 300), (345, 345), (360, 100), (336, 250)]
+
+
+def size_key(size) -> tuple:
+    return int(size["width"]), int(size["height"])
+
+
+def plan_line_item_sizes(line_items, sizes=SIZES) -> list:
+    """Adds missing sizes to creativePlaceholders and returns (line item, added sizes) of changed line items only."""
+    plan = []
+    for line_item in line_items:
+        if line_item["isArchived"]:
+            continue
+        current = {size_key(placeholder["size"]) for placeholder in line_item["creativePlaceholders"] or []}
+        missing = [size for size in dict.fromkeys(sizes) if size not in current]
+        if missing:
+            line_item["creativePlaceholders"] = list(line_item["creativePlaceholders"] or []) + [
+                {"size": {"width": width, "height": height}} for width, height in missing
+            ]
+            plan.append((line_item, missing))
+    return plan
+
+
+def plan_lica_sizes(licas, sizes=SIZES) -> list:
+    """Adds missing sizes to LICA sizes and returns (LICA, added sizes) of changed LICAs only."""
+    plan = []
+    for lica in licas:
+        current = {size_key(size) for size in lica["sizes"] or []}
+        missing = [size for size in dict.fromkeys(sizes) if size not in current]
+        if missing:
+            lica["sizes"] = list(lica["sizes"] or []) + [
+                {"width": width, "height": height, "isAspectRatio": False} for width, height in missing
+            ]
+            plan.append((lica, missing))
+    return plan
+
+
+def print_plan(plan: list, describe, verbose: bool = True) -> None:
+    if verbose:
+        for item, missing in plan:
+            print(f"{describe(item)}: add {', '.join(f'{width}x{height}' for width, height in missing)}")
+    print(f"{len(plan)} objects to update.")
+
+
+def update_line_items(client, order_id, sizes=SIZES, dry_run=False) -> int:
     line_item_service = client.line_item_service
 
     statement = (
@@ -18,43 +63,31 @@ def update_line_items(client, order_id):
         .WithBindVariable("orderId", int(order_id))
         .Limit(500)
     )
-    response = line_item_service.getLineItemsByStatement(statement.ToStatement())
-
-    if "results" in response and len(response["results"]):
-        updated_line_items = []
-        for line_item in response["results"]:
-            if not line_item["isArchived"]:
-                line_item["creativePlaceholders"].extend(
-                    [
-                        {"size": {"width": 360, "height": 300}},
-                        {"size": {"width": 345, "height": 345}},
-                        {"size": {"width": 360, "height": 100}},
-                        {"size": {"width": 336, "height": 250}},
-                    ]
-                )
-                updated_line_items.append(line_item)
-
-        for items in item_chunks(updated_line_items, 100):
-            line_items = line_item_service.updateLineItems(items)
-
-        if line_items:
-            for line_item in line_items:
-                print(
-                    'Line item with id "%s", belonging to order id "%s", named '
-                    '"%s"'
-                    % (
-                        line_item["id"],
-                        line_item["orderId"],
-                        line_item["name"],
-                    )
+    plan = plan_line_item_sizes(client.iter_items(statement, line_item_service.getLineItemsByStatement), sizes)
+    print_plan(plan, lambda line_item: f'Line item "{line_item["name"]}" ({line_item["id"]})', dry_run)
+    if dry_run or not plan:
+        return 0
+
+    updated = 0
+    for items in item_chunks([line_item for line_item, _ in plan], 100):
+        line_items = line_item_service.updateLineItems(items)
+        updated += len(line_items)
+        for line_item in line_items:
+            print(
+                'Line item with id "%s", belonging to order id "%s", named '
+                '"%s" was updated.'
+                % (
+                    line_item["id"],
+                    line_item["orderId"],
+                    line_item["name"],
                 )
-        else:
-            print("No line items were updated.")
-    else:
-        print("No line items found to update.")
+            )
+    print(f"Updated line items: {updated}")
+
+    return updated
 
 
-def update_licas(client, creative_id):
+def update_licas(client, creative_id, sizes=SIZES, dry_run=False) -> int:
     lica_service = client.lica_service
 
     statement = (
@@ -63,43 +96,28 @@ def update_licas(client, creative_id):
         .WithBindVariable("creativeId", int(creative_id))
         .Limit(500)
     )
-
-    while True:
-        response = lica_service.getLineItemCreativeAssociationsByStatement(
-            statement.ToStatement()
-        )
-
-        if "results" in response and len(response["results"]):
-            updated_licas = []
-            for lica in response["results"]:
-                lica["sizes"].extend(
-                    [
-                        {"width": 360, "height": 300, "isAspectRatio": False},
-                        {"width": 345, "height": 345, "isAspectRatio": False},
-                        {"width": 360, "height": 100, "isAspectRatio": False},
-                        {"width": 336, "height": 250, "isAspectRatio": False},
-                    ]
-                )
-                updated_licas.append(lica)
-
-            for items in item_chunks(updated_licas, 100):
-                licas = lica_service.updateLineItemCreativeAssociations(items)
-
-            for lica in licas:
-                print(
-                    'LICA with line item id "%s", creative id "%s", and status '
-                    '"%s" was updated.'
-                    % (lica["lineItemId"], lica["creativeId"], lica["status"])
-                )
-            statement.offset += statement.limit
-        else:
-            break
-
-    if response["totalResultSetSize"] == 0:
-        print("No LICAs found to update.")
+    plan = plan_lica_sizes(client.iter_items(statement, lica_service.getLineItemCreativeAssociationsByStatement), sizes)
+    print_plan(plan, lambda lica: f'LICA of line item {lica["lineItemId"]} and creative {lica["creativeId"]}', dry_run)
+    if dry_run or not plan:
+        return 0
+
+    updated = 0
+    for items in item_chunks([lica for lica, _ in plan], 100):
+        licas = lica_service.updateLineItemCreativeAssociations(items)
+        updated += len(licas)
+        for lica in licas:
+            print(
+                'LICA with line item id "%s", creative id "%s", and status '
+                '"%s" was updated.'
+                % (lica["lineItemId"], lica["creativeId"], lica["status"])
+            )
+    print(f"Updated LICAs: {updated}")
+
+    return updated
 
 
 if __name__ == "__main__":
+    dry_run = "--dry-run" in sys.argv
     gam = AdOpsAdManagerClient("dariusz.siudak***REMOVED***", "***REMOVED***")
     for order in [
         3028495157,
@@ -109,7 +127,7 @@ if __name__ == "__main__":
         3028496846,
         3029409492,
     ]:
-        update_line_items(gam, order)
+        update_line_items(gam, order, dry_run=dry_run)
     for creative in [
         138392519164,
         138392519122,
@@ -120,4 +138,4 @@ if __name__ == "__main__":
         138392519131,
         138392519128,
     ]:
-        update_licas(gam, creative)
+        update_licas(gam, creative, dry_run=dry_run)
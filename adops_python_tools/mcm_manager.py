@@ -89,8 +89,7 @@ class MultipleCustomerManagement:
             self.create_publishers(valid_publishers)
 
         valid_publishers = [publisher["publisher.name"] for publisher in valid_publishers]
-        statement = self.ad_manager.build_statement("name", valid_publishers)
-        status = self.ad_manager.get_items_by_statement(statement, self.ad_manager.company_service.getCompaniesByStatement)
+        status = self.ad_manager.get_items_by_values("name", valid_publishers, self.ad_manager.company_service.getCompaniesByStatement)
 
         return self.spreadsheet_dataframe.update_publishers(dataframe, status)
 
@@ -107,8 +106,7 @@ class MultipleCustomerManagement:
                 conflictive_sites = self.handle_error_already_exists(e.errors, unique_sites)
 
         valid_sites = list(set([site["site.url"] for site in valid_sites]))
-        statement = self.ad_manager.build_statement("url", valid_sites)
-        sites_status = self.ad_manager.get_items_by_statement(statement, self.ad_manager.site_service.getSitesByStatement)
+        sites_status = self.ad_manager.get_items_by_values("url", valid_sites, self.ad_manager.site_service.getSitesByStatement)
         sites_status = self.update_status_for_conflictive_sites(conflictive_sites, sites_status)
 
         return self.spreadsheet_dataframe.update_sites(dataframe, sites_status)
@@ -0,0 +1,53 @@
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable
+
+from adops_ad_manager import AdOpsAdManagerClient
+from constants import NETWORK_WORKERS
+
+logger = logging.getLogger(__name__)
+
+NetworkJob = namedtuple("NetworkJob", ["email", "network_code", "kwargs"])
+NetworkResult = namedtuple("NetworkResult", ["network_code", "result", "error"])
+
+
+class AdManagerClientPool:
+    """Keeps one warm AdOpsAdManagerClient per (email, network code) and runs operations across networks."""
+
+    def __init__(self, max_workers: int = NETWORK_WORKERS) -> None:
+        self.max_workers = max_workers
+        self.clients: Dict[tuple, AdOpsAdManagerClient] = {}
+        self.lock = threading.Lock()
+
+    def get(self, email: str, network_code: str) -> AdOpsAdManagerClient:
+        key = (email, str(network_code))
+        with self.lock:
+            if key not in self.clients:
+                logger.info(f"Creating Ad Manager client for network {network_code}")
+                self.clients[key] = AdOpsAdManagerClient(email, str(network_code))
+            return self.clients[key]
+
+    def available_networks(self, email: str, network_code: str) -> list:
+        return [network["networkCode"] for network in self.get(email, network_code).all_networks]
+
+    def run(self, operation: Callable, jobs: Dict[str, NetworkJob]) -> Dict[str, NetworkResult]:
+        """Runs operation(client, **job.kwargs) concurrently for every job, results are keyed like jobs."""
+
+        def execute(label, job):
+            try:
+                result = operation(self.get(job.email, job.network_code), **job.kwargs)
+                return NetworkResult(job.network_code, result, None)
+            except Exception as error:
+                logger.error(f"Operation {getattr(operation, '__name__', operation)} failed for {label}: {error}")
+                return NetworkResult(job.network_code, None, error)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {label: executor.submit(execute, label, job) for label, job in jobs.items()}
+
+        return {label: future.result() for label, future in futures.items()}
+
+    def fan_out(self, operation: Callable, email: str, network_codes: Iterable[str], **kwargs) -> Dict[str, NetworkResult]:
+        """Runs the same operation with the same arguments on every network code."""
+        return self.run(operation, {str(code): NetworkJob(email, str(code), kwargs) for code in network_codes})
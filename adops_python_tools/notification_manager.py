@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import base64
 import logging
+from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from pathlib import PurePath
@@ -15,8 +16,8 @@ from constants import (MCM_MANAGER_PATH, REPORT_MANAGER_PATH, TODAY,
                        TOKEN_EXPIRY, TOKEN_URI, USER_AGENT)
 from database import Database
 from mcm_manager import MultipleCustomerManagement
-from report_manager import (ReportManager, dataframe_to_html,
-                            process_adx_fillrate_report)
+from html_renderer import csv_attachment, dataframe_to_html
+from report_manager import ReportManager, process_adx_fillrate_report
 from spreadsheet_manager import SpreadsheetDataframe, SpreadsheetManager
 
 logging.getLogger("googleapiclient").setLevel(logging.ERROR)
@@ -95,11 +96,15 @@ class NotificationManager:
 
         return html
 
-    def create_message(self, to, sender, subject, message_body):
-        message = MIMEMultipart("alternative")
+    def create_message(self, to, sender, subject, message_body, attachments=None):
+        message = MIMEMultipart("mixed" if attachments else "alternative")
         message.attach(
             MIMEText(message_body, "html")
         )
+        for filename, content in (attachments or {}).items():
+            attachment = MIMEApplication(content, "gzip")
+            attachment.add_header("Content-Disposition", "attachment", filename=filename)
+            message.attach(attachment)
         message["to"] = to
         message["from"] = sender
         message["subject"] = TODAY + " - " + subject
@@ -147,16 +152,25 @@ def mox_mcm_status_update(env="test"):
         config[env]["notification"]["to"],
         config[env]["notification"]["sender"],
         config[env]["notification"]["subject"],
-        message
+        message,
+        csv_attachment(status_dataframe, "status_domen"),
     )
     notification_manager.send_message(message)
 
 def adx_fillrate_notification():
     admanager_client = AdOpsAdManagerClient("dariusz.siudak***REMOVED***", "***REMOVED***")
-    report_path = ReportManager(REPORT_MANAGER_PATH).get_report(admanager_client, "adxFillRateNotification")
-    dataframe = process_adx_fillrate_report(PurePath(report_path))
+    report_manager = ReportManager(REPORT_MANAGER_PATH)
+    report_path = report_manager.get_report(admanager_client, "adxFillRateNotification")
+    if report_path is None:
+        logger.error("adxFillRateNotification report failed, ADX fillrate notification not sent.")
+        return
+    dataframe = process_adx_fillrate_report(
+        PurePath(report_path),
+        report_manager.rules["adxFillRateNotification"],
+        chunk_size=report_manager.config.get("chunkSize"),
+    )
     html_table = dataframe_to_html(dataframe)
     notification_manager = NotificationManager("dariusz.siudak***REMOVED***")
     message = notification_manager.adx_fillrate_message(html_table)
-    message = notification_manager.create_message("dariusz.siudak***REMOVED***, ***REMOVED***", "dariusz.siudak***REMOVED***", "ADX fillrate GAM Company Y (***REMOVED***)", message)
+    message = notification_manager.create_message("dariusz.siudak***REMOVED***, ***REMOVED***", "dariusz.siudak***REMOVED***", "ADX fillrate GAM Company Y (***REMOVED***)", message, csv_attachment(dataframe, "adx_fillrate"))
     notification_manager.send_message(message)
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from collections import deque
+from pathlib import PurePath
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from constants import PATTERN_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def list_patterns(items: Iterable[str]) -> List[str]:
+    """Normalizes whitelist/blacklist entries: the part before the first dot, stripped and lowercased."""
+    return sorted(set(item.split(".")[0].strip().lower() for item in items) - {""})
+
+
+class PatternMatcher:
+    """Aho-Corasick automaton for case-insensitive substring matching of many patterns in one pass."""
+
+    # Part of the cache key, bumped whenever the pickled attributes change.
+    CACHE_VERSION = 1
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.patterns = sorted(set(pattern.lower() for pattern in patterns if pattern))
+        self.transitions = [{}]
+        self.failure = [0]
+        self.output: List[Optional[str]] = [None]
+        for pattern in self.patterns:
+            node = 0
+            for character in pattern:
+                if character not in self.transitions[node]:
+                    self.transitions.append({})
+                    self.failure.append(0)
+                    self.output.append(None)
+                    self.transitions[node][character] = len(self.transitions) - 1
+                node = self.transitions[node][character]
+            self.output[node] = pattern
+        self.build_failure_links()
+
+    def build_failure_links(self) -> None:
+        queue = deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for character, child in self.transitions[node].items():
+                queue.append(child)
+                fallback = self.failure[node]
+                while fallback and character not in self.transitions[fallback]:
+                    fallback = self.failure[fallback]
+                self.failure[child] = self.transitions[fallback].get(character, 0)
+                if self.output[child] is None:
+                    self.output[child] = self.output[self.failure[child]]
+
+    @classmethod
+    def from_file(cls, path: str, cache_dir: str = PATTERN_CACHE_DIR) -> "PatternMatcher":
+        """Builds the matcher for a list file, reusing an on-disk copy keyed by the file content hash."""
+        with open(PurePath(path), "rb") as list_file:
+            content = list_file.read()
+        cache_path = os.path.join(cache_dir, f"v{cls.CACHE_VERSION}_{hashlib.sha256(content).hexdigest()}.pickle")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as cache_file:
+                return pickle.load(cache_file)
+
+        matcher = cls(list_patterns(content.decode().splitlines()))
+        os.makedirs(cache_dir, exist_ok=True)
+        # Concurrent loads of the same list each write their own temporary file.
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as cache_file:
+            pickle.dump(matcher, cache_file)
+        os.replace(cache_file.name, cache_path)
+        logger.debug(f"Pattern matcher for {path} with {len(matcher.patterns)} patterns cached in {cache_path}")
+        return matcher
+
+    def search(self, text: str) -> Optional[str]:
+        """Returns the first pattern found in text, or None."""
+        transitions, failure, output = self.transitions, self.failure, self.output
+        node = 0
+        for character in text.lower():
+            while node and character not in transitions[node]:
+                node = failure[node]
+            node = transitions[node].get(character, 0)
+            if output[node] is not None:
+                return output[node]
+        return None
+
+    def match_series(self, series: pd.Series) -> pd.Series:
+        """Matched pattern (or None) of every row. Each distinct value is scanned only once."""
+        values = series.astype(str)
+        matches = {value: self.search(value) for value in pd.unique(values)}
+        return values.map(matches)
+
+    def mask(self, series: pd.Series) -> np.ndarray:
+        return self.match_series(series).notna().to_numpy(dtype=bool)
@@ -1,40 +1,64 @@
 import logging
 from pathlib import PurePath
-import re
+from typing import Dict, Iterator, Optional
 
+import numpy as np
 import pandas as pd
 from googleads import errors
-from googleads.ad_manager import StatementBuilder
 
 from adops_ad_manager import AdOpsAdManagerClient
+from columnar_report import iter_report_chunks, load_report
 from config_reader import ConfigReader
-from constants import API_VERSION, REPORT_MANAGER_PATH
-from report_manager import ReportManager
+from constants import REPORT_MANAGER_PATH
+from pattern_matcher import PatternMatcher
+from report_manager import ReportManager, ReportRequest
+from report_warehouse import ReportWarehouse
 
 logger = logging.getLogger(__name__)
 
 class PlacementManager:
     def __init__(self, config_path) -> None:
         self.report_manager = ReportManager(REPORT_MANAGER_PATH)
+        self.report_warehouse = ReportWarehouse(self.report_manager)
         self.config_reader = ConfigReader(config_path)
         self.config = self.config_reader.read_yaml_config()
+        self.matchers = {}
 
-    def clean_up_report(self, report: PurePath) -> pd.DataFrame:
-        dataframe = pd.read_csv(report, compression="gzip")
-        dataframe["Column.AD_EXCHANGE_AD_REQUEST_ECPM"] /= 1000000
-        dataframe["Column.AD_EXCHANGE_ACTIVE_VIEW_VIEWABLE"] *= 100
-        dataframe["Column.AD_EXCHANGE_AD_REQUEST_CTR"] *= 100
-        dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"] = dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"].astype(str)
+    def clean_up_report(self, report: PurePath, columns: list = None) -> pd.DataFrame:
+        return self.transform_report(load_report(report, columns))
+
+    def iter_report_chunks(self, report: PurePath, chunk_size: int, columns: list = None) -> Iterator[pd.DataFrame]:
+        for chunk in iter_report_chunks(report, chunk_size, columns):
+            yield self.transform_report(chunk)
+
+    def transform_report(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        dataframe = self.report_manager.rules["placementPerformance"].apply(dataframe)
+        # Ad unit ids are stored as int64, converting the distinct values only.
+        dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"] = (
+            dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"].astype("category").cat.rename_categories(str)
+        )
 
         return dataframe
 
-    def filter_by_label_sign(self, dataframe: pd.DataFrame, pattern: str, is_positive: bool=True) -> pd.DataFrame:
-        ad_unit_label = dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"].str.contains(pattern, regex=True, flags=re.IGNORECASE, case=False)
-        url_label = dataframe["Dimension.AD_EXCHANGE_URL"].str.contains(pattern, regex=True, flags=re.IGNORECASE, case=False)
+    def matcher(self, path: str) -> PatternMatcher:
+        if path not in self.matchers:
+            self.matchers[path] = PatternMatcher.from_file(path)
+        return self.matchers[path]
+
+    def label_mask(self, dataframe: pd.DataFrame, matcher: PatternMatcher) -> np.ndarray:
+        ad_unit_label = matcher.match_series(dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"])
+        url_label = matcher.match_series(dataframe["Dimension.AD_EXCHANGE_URL"])
+        label = ad_unit_label.fillna(url_label)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Matched patterns: %s", label.value_counts().head(20).to_dict())
+        return label.notna().to_numpy(dtype=bool)
+
+    def filter_by_label_sign(self, dataframe: pd.DataFrame, matcher: PatternMatcher, is_positive: bool=True) -> pd.DataFrame:
+        label = self.label_mask(dataframe, matcher)
         if is_positive:
-            dataframe = dataframe.loc[(ad_unit_label) | (url_label)]
+            dataframe = dataframe.loc[label]
         else:
-            dataframe = dataframe.loc[~((ad_unit_label) | (url_label))]
+            dataframe = dataframe.loc[~label]
         return dataframe
 
     def filter_by_performance(self, dataframe: pd.DataFrame, config: dict) -> pd.DataFrame:
@@ -45,27 +69,17 @@ class PlacementManager:
         ]
         return dataframe
 
-    def filter_pattern(self, items: list) -> str:
-        return "|".join(list(
-            set(
-                [item.split(".")[0].strip().lower() for item in items]
-            )
-        ))
-
     def filter_by_list_type(self, dataframe: pd.DataFrame, config: dict) -> pd.DataFrame:
         if "whitelist" in config:
-            items = self.config_reader.read_txt_config(config["whitelist"])
-            dataframe = self.filter_by_label_sign(dataframe, self.filter_pattern(items), True)
+            dataframe = self.filter_by_label_sign(dataframe, self.matcher(config["whitelist"]), True)
             logger.info("Number of ad units after placement whitelist check: %s", len(dataframe))
         if  "blacklist" in config:
-            items = self.config_reader.read_txt_config(config["blacklist"])
-            dataframe = self.filter_by_label_sign(dataframe, self.filter_pattern(items), False)
+            dataframe = self.filter_by_label_sign(dataframe, self.matcher(config["blacklist"]), False)
             logger.info("Number of ad units after placement blacklist check: %s", len(dataframe))
         return dataframe
 
     def filter_by_general_blacklist(self, dataframe: pd.DataFrame) -> pd.DataFrame:
-        blacklisted_ad_units = self.config_reader.read_txt_config(self.config["generalBlacklist"])
-        dataframe = self.filter_by_label_sign(dataframe, self.filter_pattern(blacklisted_ad_units), False)
+        dataframe = self.filter_by_label_sign(dataframe, self.matcher(self.config["generalBlacklist"]), False)
         logger.info("Number of ad units after general blacklist check: %s", len(dataframe))
         return dataframe
 
@@ -76,41 +90,134 @@ class PlacementManager:
         logger.info("Number of ad units after filtering: %s", len(dataframe))
         return list(set(dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"]))
 
-    def get_placement_by_id(self, client: AdOpsAdManagerClient, placement_id: str) -> dict:
-        statement = (
-            StatementBuilder(version=API_VERSION)
-            .Where("id = :id")
-            .OrderBy("id", ascending=True)
-            .Limit(1)
-            .WithBindVariable("id", placement_id)
-        )
-        logger.debug("Statement to retrieve placement: %s", statement.ToStatement())
-        return statement.ToStatement()
-
-    def update_placement(self, client: AdOpsAdManagerClient, placement_id: str, ad_unit_list: list) -> str:
-        response = client.placement_service.getPlacementsByStatement(self.get_placement_by_id(client, placement_id))
-        if "results" in response and len(response["results"]):
-            placement = response["results"][0]
-            placement["targetedAdUnitIds"] = ad_unit_list
-            try:
-                updated_placements = client.placement_service.updatePlacements([placement])
-                for placement in updated_placements:
-                    logger.info(f"Placement with id: 123456789zz{placement['id']} and name {placement['name']} was updated.")
-            except errors.GoogleAdsServerFault as e:
-                logger.error(
-                    f"Placement {placement['name']} couldn't be updated because of {e.errors[0]['errorString']}."
-                )
-
-        return placement_id
+    def evaluate_placements(self, dataframe: pd.DataFrame, placements: list) -> dict:
+        """Returns ad unit ids of every placement, computed together from one row x placement boolean matrix.
+
+        Same rules as filter_ad_units, but the general blacklist and each list file
+        are matched once and the performance bands of all placements sharing a
+        column are evaluated in a single broadcast comparison.
+        """
+        matrix = np.zeros((len(dataframe), len(placements)), dtype=bool)
+        ad_requests = dataframe["Column.AD_EXCHANGE_AD_REQUESTS"].to_numpy()
+        min_ad_requests = np.array([placement["minAdRequests"] for placement in placements])
+
+        for column in dict.fromkeys(placement["column"] for placement in placements):
+            indexes = [index for index, placement in enumerate(placements) if placement["column"] == column]
+            values = dataframe[column].to_numpy()[:, None]
+            matrix[:, indexes] = (
+                (values >= np.array([placements[index]["minn"] for index in indexes]))
+                & (values <= np.array([placements[index]["maxn"] for index in indexes]))
+                & (ad_requests[:, None] > min_ad_requests[indexes])
+            )
 
-    def update_performance_placements(self, publisher="Company Y") -> None:
-        ad_manager_client = AdOpsAdManagerClient(
-            self.config[publisher]["email"],
-            self.config[publisher]["networkCode"]
+        list_masks = {}
+
+        def list_mask(path: str) -> np.ndarray:
+            if path not in list_masks:
+                list_masks[path] = self.label_mask(dataframe, self.matcher(path))
+            return list_masks[path]
+
+        for index, placement in enumerate(placements):
+            if "whitelist" in placement:
+                matrix[:, index] &= list_mask(placement["whitelist"])
+            if "blacklist" in placement:
+                matrix[:, index] &= ~list_mask(placement["blacklist"])
+        matrix &= ~list_mask(self.config["generalBlacklist"])[:, None]
+
+        ad_unit_ids = dataframe["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"].to_numpy()
+        result = {}
+        for index, placement in enumerate(placements):
+            result[placement["id"]] = list(set(ad_unit_ids[matrix[:, index]]))
+
+        return result
+
+    def evaluate_placements_in_chunks(self, report: PurePath, placements: list, chunk_size: int) -> dict:
+        """Same result as evaluate_placements on the whole report, with peak memory bounded by chunk_size rows.
+
+        Every report row is evaluated on its own, so the ad unit sets of the chunks
+        are simply merged.
+        """
+        result = {placement["id"]: set() for placement in placements}
+        for chunk in self.iter_report_chunks(report, chunk_size):
+            for placement_id, ad_units in self.evaluate_placements(chunk, placements).items():
+                result[placement_id].update(ad_units)
+
+        return {placement_id: list(ad_units) for placement_id, ad_units in result.items()}
+
+    @staticmethod
+    def plan_placement_updates(placements: list, ad_units: dict) -> list:
+        """Placements whose targeted ad units differ from the computed ones, with targetedAdUnitIds replaced."""
+        changed = []
+        for placement in placements:
+            current = set(str(ad_unit_id) for ad_unit_id in placement["targetedAdUnitIds"] or [])
+            new = set(str(ad_unit_id) for ad_unit_id in ad_units[str(placement["id"])])
+            logger.info(
+                f"Placement {placement['name']} ({placement['id']}): {len(new - current)} ad units added, "
+                f"{len(current - new)} removed, {len(new & current)} unchanged"
             )
-        report_path = self.report_manager.get_report(ad_manager_client, "placementPerformance")
-        dataframe = self.clean_up_report(report_path)
+            if new != current:
+                placement["targetedAdUnitIds"] = sorted(new)
+                changed.append(placement)
+        return changed
+
+    def update_placements(self, client: AdOpsAdManagerClient, ad_units: dict) -> int:
+        """Sets the computed ad units of placements, in one read and at most one batched write.
+
+        Returns the number of updated placements.
+        """
+        ad_units = {str(placement_id): ad_unit_ids for placement_id, ad_unit_ids in ad_units.items()}
+        # String keys are only used for the diff, the id column is bound as numbers.
+        placements = client.get_items_by_values(
+            "id", [int(placement_id) for placement_id in ad_units], client.placement_service.getPlacementsByStatement
+        )
+        for placement_id in set(ad_units) - set(str(placement["id"]) for placement in placements):
+            logger.warning(f"Placement {placement_id} does not exist")
+
+        changed = self.plan_placement_updates(placements, ad_units)
+        if not changed:
+            logger.info("All placements are up to date")
+            return 0
+        try:
+            updated_placements = client.placement_service.updatePlacements(changed)
+        except errors.GoogleAdsServerFault as e:
+            # The batch is rejected as a whole, so one invalid placement must not block the others.
+            logger.error(f"Batched placement update failed because of {e.errors[0]['errorString']}, updating one by one.")
+            updated_placements = []
+            for placement in changed:
+                try:
+                    updated_placements += client.placement_service.updatePlacements([placement])
+                except errors.GoogleAdsServerFault as e:
+                    logger.error(
+                        f"Placement {placement['name']} couldn't be updated because of {e.errors[0]['errorString']}."
+                    )
+        for placement in updated_placements:
+            logger.info(f"Placement with id: {placement['id']} and name {placement['name']} was updated.")
+
+        return len(updated_placements)
+
+    def get_performance_reports(self, clients: Dict[str, AdOpsAdManagerClient]) -> Dict[str, Optional[PurePath]]:
+        """placementPerformance reports of several publishers (keys of clients), with the report jobs running concurrently."""
+        if self.report_warehouse.enabled("placementPerformance"):
+            return self.report_warehouse.get_reports(clients, "placementPerformance")
+        return self.report_manager.get_reports(
+            {publisher: ReportRequest(client, "placementPerformance") for publisher, client in clients.items()}
+        )
+
+    def update_performance_placements(
+        self, publisher="Company Y", ad_manager_client: AdOpsAdManagerClient = None, report_path: PurePath = None
+    ) -> None:
+        if ad_manager_client is None:
+            ad_manager_client = AdOpsAdManagerClient(
+                self.config[publisher]["email"],
+                self.config[publisher]["networkCode"]
+                )
+        if report_path is None:
+            report_path = self.get_performance_reports({publisher: ad_manager_client})[publisher]
+        placements = self.config[publisher]["placements"]
+        chunk_size = self.report_manager.config.get("chunkSize")
+        if chunk_size:
+            evaluated = self.evaluate_placements_in_chunks(report_path, placements, chunk_size)
+        else:
+            evaluated = self.evaluate_placements(self.clean_up_report(report_path), placements)
 
-        for placement in self.config[publisher]["placements"]:
-            ad_units = self.filter_ad_units(dataframe, placement)
-            self.update_placement(ad_manager_client, placement["id"], ad_units)
+        self.update_placements(ad_manager_client, evaluated)
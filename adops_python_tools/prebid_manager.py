@@ -1,7 +1,8 @@
 from distutils.command.config import config
 import logging
 from collections import namedtuple
-from typing import Union, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Dict, List, Optional
 from pathlib import PurePath
 from googleads.errors import GoogleAdsServerFault
 import datetime
@@ -11,13 +12,20 @@ import yaml
 
 from adops_ad_manager import AdOpsAdManagerClient
 from config_reader import ConfigReader
-from constants import PREBID_MANAGER_PATH
+from constants import PREBID_MANAGER_PATH, PREBID_ORDER_WORKERS
+from entity_store import EntityStore
 from helpers import item_chunks, random_id
+from key_value_index import KeyValueIndex
+from price_granularity import MAX_LINE_ITEMS_PER_ORDER, PrebidOrder, plan_orders
 
 logger = logging.getLogger(__name__)
 
+# Lookups shared by every order of a build, resolved once by PrebidManager.resolve_context.
+PrebidContext = namedtuple("PrebidContext", ["client", "user_id", "network", "key_values", "creative_ids", "line_item_template"])
+
 class PrebidManager:
     def __init__(self, config_path: str) -> None:
+        self.config_path = config_path
         self.config = ConfigReader(config_path).read_yaml_config()
 
     def size_converter(self, sizes: str, service: str = "li") -> List[Dict]:
@@ -30,11 +38,24 @@ class PrebidManager:
 
         return [{"size": {"width": size.width, "height": size.height}} for size in creative_placeholders]
 
-    def create_order(self, client: AdOpsAdManagerClient, start: float, step: float, ammount: int):
+    def plan_orders(self) -> List[PrebidOrder]:
+        """Orders of the priceGranularity (or custom priceBuckets) in the config."""
+        orders = plan_orders(
+            self.config.get("name"),
+            self.config.get("currency"),
+            self.config.get("priceGranularity", "medium"),
+            self.config.get("priceBuckets"),
+            self.config.get("pricePrecision", 2),
+            self.config.get("maxLineItemsPerOrder", MAX_LINE_ITEMS_PER_ORDER),
+        )
+        logger.info(f"Planned {len(orders)} orders with {sum(len(order.prices) for order in orders)} line items")
+        return orders
+
+    def create_order(self, client: AdOpsAdManagerClient, order: PrebidOrder, user_id: Optional[int] = None):
         advertiser_id = self.config["advertiserId"]
-        user_id = client.user_service.getCurrentUser()["id"]
+        user_id = user_id or client.user_service.getCurrentUser()["id"]
         order_object = {
-            "name": f"{self.config.get('name')} {start + step:.2f} - {start + (step * ammount):.2f} {self.config.get('currency')}",
+            "name": order.name,
             "advertiserId": advertiser_id,
             "salespersonId": user_id,
             "traffickerId": user_id,
@@ -54,63 +75,85 @@ class PrebidManager:
             return next(iter(order_list))["id"]
 
 
-    def prepare_line_items(self, client: AdOpsAdManagerClient, start: float, step: float, ammount: int, order_id: int) -> List[Dict]:
-        network = client.network_service.getCurrentNetwork()
-        timezone = network["timeZone"]
+    def line_item_template(self, network: Dict, key_values: KeyValueIndex) -> Dict:
+        """Everything line items of all orders share, so only the price dependent fields are built per line item."""
+        timezone = pytz.timezone(network["timeZone"])
         sdate = datetime.datetime.strptime("05/11/2019", "%d/%m/%Y")
         edate = datetime.datetime.strptime("05/11/2019", "%d/%m/%Y")
+        template = {
+            "lineItemType": "PRICE_PRIORITY",
+            "creativePlaceholders": self.size_converter(self.config.get("creativePlaceholders")),
+            "targeting": {
+                "inventoryTargeting": {"targetedAdUnits": {"adUnitId": network["effectiveRootAdUnitId"]}},
+                "customTargeting": self.set_custom_targeting(key_values, self.config.get("hbFormat"), self.config.get("environment")),
+            },
+            "startDateTimeType": "IMMEDIATELY",
+            "startDateTime": datetime.datetime(sdate.year, sdate.month, sdate.day, tzinfo=timezone),
+            "endDateTime": datetime.datetime(edate.year, edate.month, edate.day, hour=23, minute=59, tzinfo=timezone),
+            "unlimitedEndDateTime": True,
+            "costType": "CPM",
+            "primaryGoal": {"goalType": "NONE", "units": "100", "unitType": "IMPRESSIONS",},
+            "creativeRotationType": "OPTIMIZED",
+            "discountType": "PERCENTAGE",
+            "allowOverbook": "true",
+        }
+        if "native" in self.config.get("hbFormat", ["banner", "video"]):
+            template["creativePlaceholders"] = {
+                "size": {"width": "1", "height": "1"},
+                "creativeTemplateId": self.config.get("templateId"),
+                "creativeSizeType": "NATIVE",
+            }
 
-        existing_li_statement = client.build_statement("orderId", order_id)
-        existing_li = client.get_items_by_statement(existing_li_statement, client.line_item_service.getLineItemsByStatement)
-        existing_li = [li["name"] for li in existing_li]
-        logger.info(f"Existing line items: ({len(existing_li)})")
-        logger.debug(existing_li)
-        key_values = self.get_key_values(client)
+        return template
 
-        cpm = start
-        todo_line_items = []
+    def line_item_payloads(self, template: Dict, key_values: KeyValueIndex, order: PrebidOrder, order_id: int) -> List[Dict]:
+        currency = self.config.get("currency")
+        name = self.config.get("name")
+        inventory_targeting = template["targeting"]["inventoryTargeting"]
+        custom_targeting = template["targeting"]["customTargeting"]
+        hb_pb_criteria, *other_criteria = custom_targeting["children"]
 
-        for _ in range(ammount):
-            cpm = float(cpm)
-            cpm += float(step)
-            cpm = round(cpm, 2)
-            line_item = {
+        return [
+            {
+                **template,
                 "orderId": order_id,
-                "name": f"{cpm:.2f} {self.config.get('currency')} {self.config.get('name')}",
-                "lineItemType": "PRICE_PRIORITY",
-                "creativePlaceholders": self.size_converter(self.config.get("creativePlaceholders")),
+                "name": f"{price.hb_pb} {currency} {name}",
                 "targeting": {
-                    "inventoryTargeting": {"targetedAdUnits": {"adUnitId": network["effectiveRootAdUnitId"]}},
-                    "customTargeting": self.set_custom_targeting(key_values, f"{cpm:.2f}", self.config.get("hbFormat"), self.config.get("environment")),
+                    "inventoryTargeting": inventory_targeting,
+                    "customTargeting": {
+                        **custom_targeting,
+                        "children": [{**hb_pb_criteria, "valueIds": [key_values.value_id("hb_pb", price.hb_pb)]}, *other_criteria],
+                    },
                 },
-                "startDateTimeType": "IMMEDIATELY",
-                "startDateTime": datetime.datetime(sdate.year, sdate.month, sdate.day, tzinfo=pytz.timezone(timezone)),
-                "endDateTime": datetime.datetime(edate.year, edate.month, edate.day, hour=23, minute=59, tzinfo=pytz.timezone(timezone)),
-                "unlimitedEndDateTime": True,
-                "costType": "CPM",
-                "costPerUnit": {"currencyCode": self.config.get("currency"), "microAmount": int(cpm * 1000000),},
-                "primaryGoal": {"goalType": "NONE", "units": "100", "unitType": "IMPRESSIONS",},
-                "creativeRotationType": "OPTIMIZED",
-                "discountType": "PERCENTAGE",
-                "allowOverbook": "true",
+                "costPerUnit": {"currencyCode": currency, "microAmount": price.micros},
             }
-            if "native" in self.config.get("hbFormat", ["banner", "video"]):
-                line_item["creativePlaceholders"] = {
-                    "size": {"width": "1", "height": "1"},
-                    "creativeTemplateId": self.config.get("templateId"),
-                    "creativeSizeType": "NATIVE",
-                }
+            for price in order.prices
+        ]
 
-            cpm = f"{cpm:.2f}"
-            todo_line_items.append(line_item)
+    def prepare_line_items(
+        self,
+        client: AdOpsAdManagerClient,
+        order: PrebidOrder,
+        order_id: int,
+        key_values: Optional[KeyValueIndex] = None,
+        template: Optional[Dict] = None,
+    ) -> List[Dict]:
+        existing_li = {li["name"] for li in self.order_line_items(client, order_id)}
+        logger.info(f"Existing line items: ({len(existing_li)})")
+        logger.debug(existing_li)
+        if key_values is None:
+            key_values = self.get_key_values(client)
+            key_values.ensure_values(client, "hb_pb", [price.hb_pb for price in order.prices])
+        template = template or self.line_item_template(client.current_network, key_values)
 
+        todo_line_items = self.line_item_payloads(template, key_values, order, order_id)
         logger.info(f"Requested line items: ({len(todo_line_items)})")
         todo_line_items = [line_item for line_item in todo_line_items if line_item["name"] not in existing_li]
         logger.info(f"Line items to create: ({len(todo_line_items)})")
 
-        if (li_ammount := len(existing_li) + len(todo_line_items)) > 450:
+        if (li_ammount := len(existing_li) + len(todo_line_items)) > MAX_LINE_ITEMS_PER_ORDER:
             raise Exception(
-                f"Number of existing + requested = {li_ammount} line items exceeds maximum of 450 line items per order. Aborting."
+                f"Number of existing + requested = {li_ammount} line items exceeds maximum of {MAX_LINE_ITEMS_PER_ORDER} line items per order. Aborting."
             )
         
         return todo_line_items
@@ -172,11 +215,7 @@ class PrebidManager:
         """ Associates creatives with line items. For given order.    
         """
         sizes = self.size_converter(self.config.get("creativePlaceholders"), "licas")
-        statement = client.build_statement("creativeId", creative_id)
-        existing_licas = [
-            lica["lineItemId"]
-            for lica in client.get_items_by_statement(statement, client.lica_service.getLineItemCreativeAssociationsByStatement)
-        ]
+        existing_licas = [lica["lineItemId"] for lica in self.creative_licas(client, creative_id)]
         logger.info(f"Number of requested line items to associate with creative {creative_id}: ({len(line_item_ids)})")
         logger.info(f"Number of existing LICA for creative {creative_id}: ({len(existing_licas)})")
 
@@ -213,68 +252,118 @@ class PrebidManager:
                     logger.error(error)
             continue
 
-    def set_custom_targeting(self, key_values: List[Dict], hb_pb: str, hb_format: List[str], environment: str) -> Dict:
-        def filter_keys(key_name: str) -> Dict:
-            return [key for key in key_values if key["name"] == key_name][0]
-
-        hb_pb_key: Dict = filter_keys("hb_pb") 
-
+    def set_custom_targeting(self, key_values: KeyValueIndex, hb_format: List[str], environment: str) -> Dict:
+        """Custom targeting of the line items, the hb_pb criteria comes first and gets its valueIds per line item."""
         custom_targeting = {
             "xsi_type": "CustomCriteriaSet",
             "logicalOperator": "AND",
             "children": [{
                 "xsi_type": "CustomCriteria",
-                "keyId": hb_pb_key["id"],
-                "valueIds": hb_pb_key["values"].get(hb_pb),
+                "keyId": key_values.key_id("hb_pb"),
                 "operator": "IS",
             }],
         }
 
         if environment != "app":
-            hb_format_key: Dict = filter_keys("hb_format")
+            hb_format_values = key_values.values_of("hb_format")
             custom_targeting["children"].append({
                 "xsi_type": "CustomCriteria",
-                "keyId": hb_format_key["id"],
-                "valueIds": [hb_format_key["values"].get(key) for key in hb_format if key in hb_format_key["values"]],
+                "keyId": key_values.key_id("hb_format"),
+                "valueIds": [hb_format_values[key] for key in hb_format if key in hb_format_values],
                 "operator": "IS",
             })
 
         return custom_targeting
 
-    def get_key_values(self, client: AdOpsAdManagerClient) -> List[Dict]:
-        key_values: list[str] = self.config.get("keyValues", ["hb_format", "hb_pb"])
-        statement = client.build_statement("name", key_values)
-        keys = client.get_items_by_statement(statement, client.custom_targeting_service.getCustomTargetingKeysByStatement)
-        for key in keys:
-            v_statement = client.build_statement("customTargetingKeyId", key["id"])
-            key["values"] = client.get_items_by_statement(v_statement, client.custom_targeting_service.getCustomTargetingValuesByStatement)
-            key["values"] = {value["name"]: value["id"] for value in key["values"]}
-        print(keys[0])
-        return keys
-
-def build_prebid_setup(start: float, step: float, ammount: int) -> None:
+    def order_line_items(self, client: AdOpsAdManagerClient, order_id: int) -> List[Dict]:
+        """Line items of an order, read through the entity store when it is enabled."""
+        if not self.config.get("entityStore"):
+            statement = client.build_statement("orderId", order_id)
+            return list(client.iter_items(statement, client.line_item_service.getLineItemsByStatement, ("id", "name")))
+        with EntityStore() as store:
+            store.sync(client, "line_item", f"orderId = {int(order_id)}")
+            return store.find(str(client.current_network["networkCode"]), "line_item", orderId=int(order_id))
+
+    def creative_licas(self, client: AdOpsAdManagerClient, creative_id: str) -> List[Dict]:
+        """LICAs of a creative, read through the entity store when it is enabled."""
+        if not self.config.get("entityStore"):
+            statement = client.build_statement("creativeId", creative_id)
+            return client.get_items_by_statement(
+                statement, client.lica_service.getLineItemCreativeAssociationsByStatement, parallel=True
+            )
+        with EntityStore() as store:
+            store.sync(client, "lica", f"creativeId = {int(creative_id)}")
+            return store.find(str(client.current_network["networkCode"]), "lica", creativeId=int(creative_id))
+
+    def get_key_values(self, client: AdOpsAdManagerClient) -> KeyValueIndex:
+        key_names: List[str] = self.config.get("keyValues", ["hb_format", "hb_pb"])
+        if self.config.get("entityStore"):
+            max_age = datetime.timedelta(hours=self.config.get("entityStoreMaxAgeHours", 24))
+            return KeyValueIndex.from_store(client, key_names, max_age)
+        return KeyValueIndex.load(client, key_names)
+
+    def resolve_context(self, client: AdOpsAdManagerClient, orders: List[PrebidOrder] = ()) -> PrebidContext:
+        """Looks up what all orders share, creating the hb_pb values their prices need."""
+        self.prepare_creatives(client, self.config_path)
+        key_values = self.get_key_values(client)
+        key_values.ensure_values(client, "hb_pb", [price.hb_pb for order in orders for price in order.prices])
+        return PrebidContext(
+            client,
+            client.user_service.getCurrentUser()["id"],
+            client.current_network,
+            key_values,
+            self.config.get("creativeIds", []),
+            self.line_item_template(client.current_network, key_values),
+        )
+
+    def build_order(self, context: PrebidContext, order: PrebidOrder) -> int:
+        """Creates one order with its line items and LICAs, returns the order id."""
+        client = context.client
+        order_id = self.create_order(client, order, user_id=context.user_id)
+        todo_line_items = self.prepare_line_items(client, order, order_id, context.key_values, context.line_item_template)
+        self.create_line_items(client, todo_line_items)
+        line_item_ids = [item["id"] for item in self.order_line_items(client, order_id)]
+        for creative_id in context.creative_ids:
+            self.create_licas(client, line_item_ids, creative_id)
+
+        return order_id
+
+    def build_orders(
+        self, client: AdOpsAdManagerClient, orders: List[PrebidOrder], max_workers: int = PREBID_ORDER_WORKERS
+    ) -> Dict[PrebidOrder, Optional[int]]:
+        """Builds orders concurrently on one client and one resolved context. Failed orders map to None."""
+        context = self.resolve_context(client, orders)
+
+        def build(order):
+            try:
+                return self.build_order(context, order)
+            except Exception as error:
+                logger.error(f"Building order {order.name} failed: {error}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {order: executor.submit(build, order) for order in orders}
+
+        return {order: future.result() for order, future in futures.items()}
+
+def build_prebid_orders(orders: Optional[List[PrebidOrder]] = None, max_workers: int = PREBID_ORDER_WORKERS) -> Dict[PrebidOrder, int]:
+    """Builds orders, by default the ones planned from the price granularity in prebid_manager.yaml."""
     prebid_manager = PrebidManager(PREBID_MANAGER_PATH)
     client = AdOpsAdManagerClient(prebid_manager.config.get("email"), prebid_manager.config.get("networkCode"))
-    prebid_manager.prepare_creatives(client, PREBID_MANAGER_PATH)
+    orders = orders or prebid_manager.plan_orders()
+    order_ids = prebid_manager.build_orders(client, orders, max_workers)
+    if failed := [order.name for order, order_id in order_ids.items() if order_id is None]:
+        raise Exception(f"{len(failed)} of {len(orders)} Prebid orders failed: {failed}")
 
-    order_id = prebid_manager.create_order(client, start, step, ammount)
-    todo_line_items = prebid_manager.prepare_line_items(client, start, step, ammount, order_id)
-    prebid_manager.create_line_items(client, todo_line_items)
-    statement = client.build_statement("orderId", order_id)
-    line_item_ids = client.get_items_by_statement(statement, client.line_item_service.getLineItemsByStatement)
-    line_item_ids = [item["id"] for item in line_item_ids]
-    creative_ids = prebid_manager.config.get("creativeIds", [])
+    return order_ids
 
-    for creative_id in creative_ids:
-        prebid_manager.create_licas(client, line_item_ids, creative_id)
+def build_prebid_setup(start: float, step: float, ammount: int) -> None:
+    config = ConfigReader(PREBID_MANAGER_PATH).read_yaml_config()
+    bucket = {"min": start, "max": round(start + step * ammount, 6), "increment": step}
+    build_prebid_orders(plan_orders(config.get("name"), config.get("currency"), "custom", [bucket]))
 
 def main():
-    build_prebid_setup(0.00, 0.01, 450)
-    build_prebid_setup(4.50, 0.01, 450)
-    build_prebid_setup(9.00, 0.01, 450)
-    build_prebid_setup(13.50, 0.01, 450)
-    build_prebid_setup(18.00, 0.01, 200)
-    build_prebid_setup(20.00, 1.00, 80)
+    build_prebid_orders()
 
 if __name__ == "__main__":
     main()
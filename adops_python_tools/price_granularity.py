@@ -0,0 +1,73 @@
+from collections import namedtuple
+from decimal import Decimal
+from typing import List, Optional
+
+from helpers import item_chunks
+
+# Prebid.js price granularities, as customPriceBucket buckets. A bucket starts at
+# the max of the previous one unless it sets its own min.
+GRANULARITIES = {
+    "low": [{"max": 5, "increment": 0.5}],
+    "medium": [{"max": 20, "increment": 0.1}],
+    "high": [{"max": 20, "increment": 0.01}],
+    "auto": [{"max": 5, "increment": 0.05}, {"max": 10, "increment": 0.1}, {"max": 20, "increment": 0.5}],
+    "dense": [{"max": 3, "increment": 0.01}, {"max": 8, "increment": 0.05}, {"max": 20, "increment": 0.5}],
+}
+# Ad Manager allows 450 line items per order.
+MAX_LINE_ITEMS_PER_ORDER = 450
+
+PricePoint = namedtuple("PricePoint", ["micros", "hb_pb"])
+PrebidOrder = namedtuple("PrebidOrder", ["name", "prices"])
+
+
+def to_micros(amount) -> int:
+    return int(Decimal(str(amount)) * 1000000)
+
+
+def hb_pb(micros: int, precision: int = 2) -> str:
+    """The hb_pb value Prebid sends for a price, e.g. 1500000 -> "1.50"."""
+    fraction = micros % 1000000 // 10 ** (6 - precision)
+    return f"{micros // 1000000}.{fraction:0{precision}d}" if precision else str(micros // 1000000)
+
+
+def price_buckets(granularity: str = "medium", buckets: Optional[List[dict]] = None, precision: int = 2) -> List[List[PricePoint]]:
+    """Price points of every bucket, from min (exclusive) to max (inclusive) in integer micros."""
+    if granularity != "custom":
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown price granularity {granularity}, expected one of custom, {', '.join(GRANULARITIES)}")
+        buckets = GRANULARITIES[granularity]
+    if not buckets:
+        raise ValueError("Custom price granularity needs at least one bucket")
+
+    points = []
+    minimum = 0
+    for bucket in buckets:
+        minimum = to_micros(bucket["min"]) if "min" in bucket else minimum
+        maximum = to_micros(bucket["max"])
+        increment = to_micros(bucket["increment"])
+        if increment <= 0 or maximum <= minimum or increment % 10 ** (6 - precision):
+            raise ValueError(f"Invalid price bucket {bucket} at precision {precision}")
+        points.append([PricePoint(micros, hb_pb(micros, precision)) for micros in range(minimum + increment, maximum + 1, increment)])
+        minimum = maximum
+
+    return points
+
+
+def plan_orders(
+    name: str,
+    currency: str,
+    granularity: str = "medium",
+    buckets: Optional[List[dict]] = None,
+    precision: int = 2,
+    max_line_items: int = MAX_LINE_ITEMS_PER_ORDER,
+) -> List[PrebidOrder]:
+    """Splits the price points of a granularity into orders of at most max_line_items line items.
+
+    Orders do not span buckets, so changing one bucket leaves the orders of the others as they are.
+    """
+    orders = []
+    for points in price_buckets(granularity, buckets, precision):
+        for chunk in item_chunks(points, max_line_items):
+            orders.append(PrebidOrder(f"{name} {chunk[0].hb_pb} - {chunk[-1].hb_pb} {currency}", tuple(chunk)))
+
+    return orders
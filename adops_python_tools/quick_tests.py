@@ -1,13 +1,122 @@
 #!/usr/bin/env python3
 import logging
-from adops_ad_manager import AdOpsAdManagerClient
-from googleads.ad_manager import StatementBuilder
+import os
+import sys
+import tempfile
+import time
 
-from constants import API_VERSION
-from notification_manager import mox_mcm_status_update
+import pyarrow.feather as feather
+import yaml
 
+from api_metrics import API_METRICS
+from fake_ad_manager import FakeNetwork, fake_ad_manager_client
 
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def offline_benchmark(ad_units: int = 20000, latency: float = 0.05, quota_error_rate: float = 0.0) -> dict:
+    """Times pagination and bulk lookups against the fake Ad Manager network."""
+    network = FakeNetwork(latency=latency, quota_error_rate=quota_error_rate).populate(ad_units=ad_units)
+    client = fake_ad_manager_client(network)
+    callback = client.inventory_service.getAdUnitsByStatement
+    timings = {}
+
+    start = time.perf_counter()
+    ad_unit_ids = [item["id"] for item in client.get_items_by_statement(client.build_statement("status", "ACTIVE"), callback)]
+    timings["sequential paging"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.get_items_by_statement(client.build_statement("status", "ACTIVE"), callback, parallel=True)
+    timings["parallel paging"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    client.get_items_by_values("id", ad_unit_ids, callback)
+    timings["bulk id lookup"] = time.perf_counter() - start
+
+    for name, seconds in timings.items():
+        logger.info(f"{name}: {seconds:.2f} s")
+    API_METRICS.log_summary()
+
+    return timings
+
+
+def warehouse_refresh_check() -> None:
+    """Recent warehouse days follow changed report data, older ones stay as stored, empty recent days are not stored."""
+    from report_manager import ReportManager
+    from report_warehouse import ReportWarehouse
+
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "report_manager.yaml")) as config_file:
+        config = yaml.safe_load(config_file)
+    with tempfile.TemporaryDirectory() as directory:
+        config["outputFolderPath"] = os.path.join(directory, "reports")
+        config["warehouse"]["path"] = os.path.join(directory, "warehouse")
+        config.pop("cache")
+        config.pop("sharding")
+        config_path = os.path.join(directory, "report_manager.yaml")
+        with open(config_path, "w") as config_file:
+            yaml.safe_dump(config, config_file)
+        warehouse = ReportWarehouse(ReportManager(config_path))
+
+        network = FakeNetwork().populate(ad_units=5)
+        client = fake_ad_manager_client(network)
+        warehouse.get_report(client)
+        window = warehouse.window("placementPerformance")
+        assert warehouse.stored_dates(network.network_code, "placementPerformance") == window
+
+        # The data of every day changes after it was first stored, only the recent days are fetched again.
+        new_ad_unit = network.add("ad_unit", {"name": "new_ad_unit", "adUnitCode": "new_ad_unit", "status": "ACTIVE"})
+        warehouse.get_report(client)
+        for date in window:
+            partition = feather.read_feather(warehouse.partition_path(network.network_code, "placementPerformance", date))
+            refreshed = (partition["Dimension.AD_EXCHANGE_DFP_AD_UNIT_ID"] == new_ad_unit["id"]).any()
+            assert refreshed == (date in warehouse.refresh_dates("placementPerformance")), date
+
+        # A network without rows stores the older days empty, recent days are left to later runs.
+        empty_network = FakeNetwork(network_code="987654321")
+        warehouse.get_report(fake_ad_manager_client(empty_network))
+        stored = warehouse.stored_dates(empty_network.network_code, "placementPerformance")
+        assert stored == [date for date in window if date not in warehouse.refresh_dates("placementPerformance")]
+
+    logger.info("Warehouse refresh check passed")
+
+
+def entity_store_check() -> None:
+    """Full syncs forget deleted entities, only within the synced scope."""
+    from entity_store import EntityStore
+
+    network = FakeNetwork().populate(ad_units=20)
+    client = fake_ad_manager_client(network)
+    first, second = (network.add("line_item", {"name": f"line item {order_id}", "orderId": order_id}) for order_id in (1, 2))
+    with tempfile.TemporaryDirectory() as directory, EntityStore(os.path.join(directory, "entities.db")) as store:
+        store.sync(client, "ad_unit")
+        for order_id in (1, 2):
+            store.sync(client, "line_item", f"orderId = {order_id}")
+        deleted = network.entities["ad_unit"].pop()
+        network.entities["line_item"].remove(first)
+        network.entities["line_item"].remove(second)
+
+        # Incremental syncs do not see deletions.
+        store.sync(client, "ad_unit")
+        assert store.get(network.network_code, "ad_unit", deleted["id"])
+        store.sync(client, "ad_unit", full=True)
+        assert not store.get(network.network_code, "ad_unit", deleted["id"])
+        assert len(store.all(network.network_code, "ad_unit")) == len(network.entities["ad_unit"])
+
+        store.sync(client, "line_item", "orderId = 1", full=True)
+        assert not store.get(network.network_code, "line_item", first["id"])
+        assert store.get(network.network_code, "line_item", second["id"])
+
+    logger.info("Entity store check passed")
+
+
 if __name__ == "__main__":
-    mox_mcm_status_update("test")
+    if sys.argv[1:] == ["live"]:
+        from notification_manager import mox_mcm_status_update
+        mox_mcm_status_update("test")
+    elif sys.argv[1:] == ["warehouse"]:
+        warehouse_refresh_check()
+    elif sys.argv[1:] == ["entities"]:
+        entity_store_check()
+    else:
+        offline_benchmark()
@@ -0,0 +1,112 @@
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict
+
+from googleads.errors import GoogleAdsServerFault
+
+from constants import LIMITER_INITIAL_CONCURRENCY, LIMITER_MAX_ATTEMPTS, LIMITER_MAX_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+THROTTLING_ERRORS = {
+    "QuotaError.EXCEEDED_QUOTA",
+    "QuotaError.REPORT_JOB_LIMIT",
+    "ServerError.SERVER_BUSY",
+}
+
+
+def is_throttling_fault(error: GoogleAdsServerFault) -> bool:
+    return any(e["errorString"] in THROTTLING_ERRORS for e in (error.errors or []))
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit of in-flight API calls.
+
+    Every successful call raises the limit by increase / limit (about +increase
+    per window of calls), a quota or throttling fault multiplies it by decrease
+    and the call is retried after a jittered exponential backoff. Faults of calls
+    started before the last decrease belong to the same overload and are not
+    counted again, so the limit is decreased at most once per window.
+    """
+
+    def __init__(
+        self,
+        initial: float = LIMITER_INITIAL_CONCURRENCY,
+        minimum: float = 1,
+        maximum: float = LIMITER_MAX_CONCURRENCY,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        max_attempts: int = LIMITER_MAX_ATTEMPTS,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.in_flight = 0
+        # Incremented by every decrease, calls remember the epoch they started in.
+        self.epoch = 0
+        self.condition = threading.Condition()
+
+    def acquire(self) -> int:
+        with self.condition:
+            while self.in_flight >= max(int(self.limit), 1):
+                self.condition.wait()
+            self.in_flight += 1
+            return self.epoch
+
+    def release(self, epoch: int, throttled: bool = False, succeeded: bool = True) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                if epoch == self.epoch:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.epoch += 1
+                    logger.debug(f"Throttled, concurrency limit lowered to {self.limit:.2f}")
+            elif succeeded:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self.condition.notify_all()
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, function: Callable, *args, on_retry: Callable = None, **kwargs):
+        attempt = 1
+        while True:
+            epoch = self.acquire()
+            try:
+                result = function(*args, **kwargs)
+            except GoogleAdsServerFault as error:
+                throttled = is_throttling_fault(error)
+                self.release(epoch, throttled=throttled, succeeded=False)
+                if not throttled or attempt >= self.max_attempts:
+                    raise
+                delay = self.backoff(attempt)
+                if on_retry:
+                    on_retry(error)
+                logger.warning(f"Throttled by Ad Manager ({error}). Retry {attempt}/{self.max_attempts - 1} in {delay:.1f} s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except Exception:
+                self.release(epoch, succeeded=False)
+                raise
+            self.release(epoch)
+            return result
+
+
+_limiters: Dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(network_code) -> AdaptiveConcurrencyLimiter:
+    """Ad Manager quota is enforced per network, so all clients of a network share one limiter."""
+    with _limiters_lock:
+        return _limiters.setdefault(str(network_code), AdaptiveConcurrencyLimiter())
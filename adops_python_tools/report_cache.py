@@ -0,0 +1,92 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from pathlib import PurePath
+from typing import Iterable, Optional
+
+from columnar_report import columnar_path
+
+logger = logging.getLogger(__name__)
+
+# Files named by ReportCache.report_path, their Feather copies and unfinished writes.
+CACHE_FILE_PATTERN = re.compile(r"_[0-9a-f]{16}\.(csv\.gz|feather)(\.tmp)?$")
+
+
+class ReportCache:
+    """Downloaded reports keyed by network code, normalized report query and resolved date range.
+
+    Configured in the "cache" section of report_manager.yaml: reports younger than
+    ttlMinutes are reused instead of running the same report job again, and
+    cached reports are evicted by age (maxAgeDays) and total size (maxSizeMb),
+    oldest first. Other files in the reports folder are left alone.
+    """
+
+    def __init__(self, reports_path: str, config: dict) -> None:
+        self.reports_path = reports_path
+        self.path = config.get("path", os.path.join(reports_path, "cache"))
+        self.ttl = datetime.timedelta(minutes=config.get("ttlMinutes", 360))
+        self.max_age = datetime.timedelta(days=config.get("maxAgeDays", 7))
+        self.max_size = config.get("maxSizeMb", 5000) * 1024 * 1024
+
+    @staticmethod
+    def fingerprint(network_code: str, report_query: dict) -> str:
+        query = dict(report_query)
+        if query.get("dateRangeType") != "CUSTOM_DATE":
+            # Relative ranges (YESTERDAY, LAST_WEEK, ...) resolve to other days tomorrow.
+            query["resolvedOn"] = datetime.date.today()
+        normalized = json.dumps({"networkCode": str(network_code), "reportQuery": query}, sort_keys=True, default=str)
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def report_path(self, network_code: str, report_type: str, report_query: dict) -> PurePath:
+        fingerprint = self.fingerprint(network_code, report_query)
+        return PurePath(
+            self.path,
+            f"{network_code}_{report_type}_{report_query['startDate']}_{report_query['endDate']}_{fingerprint[:16]}.csv.gz",
+        )
+
+    def is_fresh(self, report_path: PurePath) -> bool:
+        # Streamed reports may only have their Feather copy.
+        path = next((path for path in (report_path, columnar_path(report_path)) if os.path.exists(path)), None)
+        if path is None:
+            return False
+        age = datetime.timedelta(seconds=time.time() - os.path.getmtime(path))
+        return age < self.ttl
+
+    def evict(self, keep: Iterable[PurePath] = ()) -> int:
+        """Removes cached report files older than max_age, then the oldest ones until the cache fits max_size.
+
+        Reports in keep (and their Feather copies) are never removed. Returns the number of removed files.
+        """
+        kept = set()
+        for report_path in keep:
+            kept.update((str(report_path), str(columnar_path(report_path))))
+        files = []
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                if entry.is_file() and CACHE_FILE_PATTERN.search(entry.name):
+                    files.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+        files.sort()
+
+        oldest = time.time() - self.max_age.total_seconds()
+        total_size = sum(size for _, size, _ in files)
+        removed = 0
+        for modified, size, path in files:
+            if modified >= oldest and total_size <= self.max_size:
+                break
+            if path in kept:
+                continue
+            os.remove(path)
+            total_size -= size
+            removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} files from {self.path}, {total_size / 1024 / 1024:.0f} MB left")
+
+        return removed
+
+    def get(self, network_code: str, report_type: str, report_query: dict) -> Optional[PurePath]:
+        report_path = self.report_path(network_code, report_type, report_query)
+        return report_path if self.is_fresh(report_path) else None
@@ -2,59 +2,255 @@ import datetime
 import logging
 import os
 import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import PurePath
+from typing import Dict, List, Optional
 
 import pandas
 from googleads import errors
 
 from adops_ad_manager import AdOpsAdManagerClient
+from api_metrics import API_METRICS
+from columnar_report import aggregate_report, convert_report, convert_stream, iter_report_chunks, load_report
 from config_reader import ConfigReader
+from constants import REPORT_POLL_INTERVAL, REPORT_WORKERS
+from report_cache import ReportCache
+from report_rules import ReportRules
 
 logger = logging.getLogger(__name__)
 
+REPORT_DOWNLOAD_OPTIONS = {
+    "exportFormat": "CSV_DUMP",
+    "includeReportProperties": False,
+    "includeTotalsRow": False,
+    "useGzipCompression": True,
+}
+
+ReportRequest = namedtuple(
+    "ReportRequest", ["client", "report_type", "start_date", "end_date", "dimensions"], defaults=(None, None, None)
+)
+
 class ReportManager:
     def __init__(self, config_path) -> None:
         self.config = ConfigReader(config_path).read_yaml_config()
+        self.rules = {report_type: ReportRules(steps) for report_type, steps in self.config.get("rules", {}).items()}
+        self.report_cache = ReportCache(self.config["outputFolderPath"], self.config["cache"]) if "cache" in self.config else None
 
-    def set_report_job(self, report_type: str="placementPerformance") -> dict:
-        if self.config[report_type]["dateRangeType"] == "CUSTOM_DATE":
+    def set_report_job(
+        self, report_type: str="placementPerformance", start_date: datetime.date=None, end_date: datetime.date=None, dimensions: list=None
+    ) -> dict:
+        report_query = dict(self.config[report_type])
+        if start_date is not None:
+            report_query.update({"dateRangeType": "CUSTOM_DATE", "startDate": start_date, "endDate": end_date})
+        elif report_query["dateRangeType"] == "CUSTOM_DATE":
             default_date_range = {
                 "startDate": datetime.date.today() - datetime.timedelta(30),
                 "endDate": datetime.date.today() - datetime.timedelta(1),
             }
-            self.config[report_type].update(default_date_range)
+            report_query.update(default_date_range)
+        if dimensions is not None:
+            report_query["dimensions"] = dimensions
 
         query = {
-            "reportQuery": self.config[report_type]
+            "reportQuery": report_query
         }
         return query
 
-    def get_report(self, client: AdOpsAdManagerClient, report_type: str="placementPerformance"):
+    def get_report(
+        self,
+        client: AdOpsAdManagerClient,
+        report_type: str="placementPerformance",
+        start_date: datetime.date=None,
+        end_date: datetime.date=None,
+        dimensions: list=None,
+    ) -> Optional[PurePath]:
+        request = ReportRequest(client, report_type, start_date, end_date, dimensions)
+        return self.get_reports({report_type: request})[report_type]
+
+    def get_reports(
+        self, requests: Dict[str, ReportRequest], max_workers: int=REPORT_WORKERS, poll_interval: float=REPORT_POLL_INTERVAL
+    ) -> Dict[str, Optional[PurePath]]:
+        """Runs all report jobs at once, polls them together and downloads each one as soon as it completes.
+
+        CUSTOM_DATE ranges of report types in the sharding section run as concurrent
+        jobs of shardDays days each. Only failed jobs are retried, up to maxAttempts
+        runs, and the shards are merged into one report with the unsharded schema.
+        Results are keyed like requests, reports that failed are None.
+        """
         output_path = PurePath(
             self.config["outputFolderPath"], datetime.datetime.now().strftime("%d%m%Y_%H%M")
         )
-        self.create_directory(output_path)
-        report_job = self.set_report_job(report_type)
-        report_path = PurePath(
+        self.create_directory(self.report_cache.path if self.report_cache else output_path)
+        reports = dict.fromkeys(requests)
+        report_paths = {}
+        shards = {}
+        for key, request in requests.items():
+            report_query = self.set_report_job(request.report_type, request.start_date, request.end_date, request.dimensions)["reportQuery"]
+            report_paths[key] = self.report_path(request, report_query, output_path)
+            if self.report_cache and self.report_cache.is_fresh(report_paths[key]):
+                logger.info(f"Report {key} served from cache: {report_paths[key]}")
+                reports[key] = report_paths[key]
+                continue
+            shard_requests = self.shard_requests(request, report_query)
+            if len(shard_requests) == 1:
+                shards[key] = (key, request)
+                continue
+            logger.info(f"Report {key} split into {len(shard_requests)} shards")
+            for shard_request in shard_requests:
+                shards[f"{key} {shard_request.start_date}-{shard_request.end_date}"] = (key, shard_request)
+
+        max_attempts = self.config.get("sharding", {}).get("maxAttempts", 1)
+        results = {}
+        remaining = {shard_key: shard_request for shard_key, (_, shard_request) in shards.items()}
+        for attempt in range(1, max_attempts + 1):
+            results.update(self.run_report_jobs(remaining, output_path, max_workers, poll_interval))
+            remaining = {shard_key: shards[shard_key][1] for shard_key, report_path in results.items() if report_path is None}
+            if not remaining:
+                break
+            logger.warning(f"{len(remaining)} report jobs failed in attempt {attempt} of {max_attempts}")
+
+        for key, request in requests.items():
+            shard_paths = [results[shard_key] for shard_key, (owner, _) in shards.items() if owner == key]
+            if not shard_paths:
+                continue
+            if None in shard_paths:
+                logger.error(f"Failed to generate report {key}")
+            elif len(shard_paths) == 1:
+                reports[key] = shard_paths[0]
+            else:
+                reports[key] = self.merge_reports(shard_paths, request.report_type, report_paths[key])
+        if self.report_cache:
+            self.report_cache.evict(keep=[report_path for report_path in reports.values() if report_path])
+
+        return reports
+
+    def report_path(self, request: ReportRequest, report_query: dict, output_path: PurePath) -> PurePath:
+        network_code = request.client.current_network["networkCode"]
+        if self.report_cache:
+            return self.report_cache.report_path(network_code, request.report_type, report_query)
+        return PurePath(
             output_path,
-            f"{client.network_service.getCurrentNetwork()['networkCode']}_{report_type}_{self.config[report_type]['startDate']}_{self.config[report_type]['endDate']}.csv.gz",
+            f"{network_code}_{request.report_type}_{report_query['startDate']}_{report_query['endDate']}.csv.gz",
         )
 
-        try:
-            report_job_id = client.report_downloader.WaitForReport(report_job)
-            with tempfile.NamedTemporaryFile(suffix=".csv.gz", delete=False, dir=PurePath(output_path),) as report_file:
-                client.report_downloader.DownloadReportToFile(report_job_id, "CSV_DUMP", report_file)
-                temp_file_path = report_file.name
+    def shard_requests(self, request: ReportRequest, report_query: dict) -> List[ReportRequest]:
+        shard_days = self.config.get("sharding", {}).get("shardDays", {}).get(request.report_type)
+        if not shard_days or report_query["dateRangeType"] != "CUSTOM_DATE":
+            return [request]
+        start_date, end_date = report_query["startDate"], report_query["endDate"]
+        shards = []
+        while start_date <= end_date:
+            shard_end_date = min(start_date + datetime.timedelta(shard_days - 1), end_date)
+            shards.append(request._replace(start_date=start_date, end_date=shard_end_date))
+            start_date = shard_end_date + datetime.timedelta(1)
+        return shards
+
+    def merge_reports(self, shard_paths: List[PurePath], report_type: str, report_path: PurePath) -> PurePath:
+        aggregations = self.config.get("aggregations", {}).get(report_type, {})
+        dataframe = aggregate_report(
+            pandas.concat([load_report(shard_path) for shard_path in shard_paths], ignore_index=True), aggregations
+        )
+        dataframe.to_csv(report_path, index=False, compression="gzip")
+        logger.info(f"{len(shard_paths)} shards merged to: {report_path}")
+        convert_report(report_path)
+
+        return report_path
+
+    def run_report_jobs(
+        self, requests: Dict[str, ReportRequest], output_path: PurePath, max_workers: int, poll_interval: float
+    ) -> Dict[str, Optional[PurePath]]:
+        """Runs one report job per request and downloads each one as soon as it completes.
+
+        With the report cache enabled, fresh cached reports are returned without a
+        report job and requests with the same fingerprint share one job.
+        """
+        reports = dict.fromkeys(requests)
+        pending = {}
+        duplicates = {}
+        for key, request in requests.items():
+            report_job = self.set_report_job(request.report_type, request.start_date, request.end_date, request.dimensions)
+            report_path = self.report_path(request, report_job["reportQuery"], output_path)
+            if self.report_cache:
+                if self.report_cache.is_fresh(report_path):
+                    logger.info(f"Report {key} served from cache: {report_path}")
+                    reports[key] = report_path
+                    continue
+                submitted = next((other for other, (_, path) in pending.items() if path == report_path), None)
+                if submitted is not None:
+                    logger.info(f"Report {key} is the same as {submitted}, reusing its report job")
+                    duplicates[key] = submitted
+                    continue
             try:
-                os.rename(temp_file_path, report_path)
-            except FileExistsError:
-                logger.info(f"Report already exist. Deleting old report {report_path}")
-                os.remove(report_path)
-                os.rename(temp_file_path, report_path)
-            finally:
-                logger.info(f"Report job with id {report_job_id} downloaded to: {report_path}")
-        except errors.AdManagerReportError as e:
-            logger.error(f"Failed to generate report. Error was: {e}")
+                report_job_id = request.client.report_service.runReportJob(report_job)["id"]
+                logger.info(f"Report job with id {report_job_id} started for {key}")
+                pending[key] = (report_job_id, report_path)
+            except errors.GoogleAdsServerFault as e:
+                logger.error(f"Failed to start report job for {key}. Error was: {e}")
+
+        downloads = {}
+        delay = min(1, poll_interval)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending:
+                for key, (report_job_id, report_path) in list(pending.items()):
+                    try:
+                        status = requests[key].client.report_service.getReportJobStatus(report_job_id)
+                    except errors.GoogleAdsServerFault as e:
+                        # Only this report is lost, get_reports retries it with the other failed ones.
+                        logger.error(f"Failed to get status of report {key}, report job {report_job_id}. Error was: {e}")
+                        del pending[key]
+                        continue
+                    if status == "COMPLETED":
+                        downloads[key] = executor.submit(
+                            self.download_report, requests[key].client, report_job_id, report_path
+                        )
+                        del pending[key]
+                    elif status == "FAILED":
+                        logger.error(f"Failed to generate report {key}, report job {report_job_id} failed.")
+                        del pending[key]
+                if pending:
+                    time.sleep(delay)
+                    delay = min(delay * 2, poll_interval)
+
+            for key, download in downloads.items():
+                try:
+                    reports[key] = download.result()
+                except Exception as e:
+                    logger.error(f"Failed to download report {key}. Error was: {e}")
+
+        for key, submitted in duplicates.items():
+            reports[key] = reports[submitted]
+
+        return reports
+
+    def download_report(self, client: AdOpsAdManagerClient, report_job_id: int, report_path: PurePath) -> PurePath:
+        if self.config.get("streamDownloads"):
+            return self.stream_report(client, report_job_id, report_path)
+        with tempfile.NamedTemporaryFile(suffix=".csv.gz", delete=False, dir=report_path.parent,) as report_file:
+            client.report_downloader.DownloadReportToFile(report_job_id, "CSV_DUMP", report_file)
+            temp_file_path = report_file.name
+        try:
+            os.rename(temp_file_path, report_path)
+        except FileExistsError:
+            logger.info(f"Report already exist. Deleting old report {report_path}")
+            os.remove(report_path)
+            os.rename(temp_file_path, report_path)
+        finally:
+            logger.info(f"Report job with id {report_job_id} downloaded to: {report_path}")
+        convert_report(report_path)
+
+        return report_path
+
+    def stream_report(self, client: AdOpsAdManagerClient, report_job_id: int, report_path: PurePath) -> PurePath:
+        """Parses the report while it downloads, the raw .csv.gz is kept at report_path with archiveRawReports."""
+        report_url = client.report_service.getReportDownloadUrlWithOptions(report_job_id, REPORT_DOWNLOAD_OPTIONS)
+        start = time.perf_counter()
+        with client.report_downloader.url_opener.open(report_url) as response:
+            response_bytes = convert_stream(response, report_path, archive=self.config.get("archiveRawReports", True))
+        API_METRICS.record_call("DataDownloader", "StreamReport", time.perf_counter() - start)
+        API_METRICS.record_bytes("DataDownloader", "StreamReport", response_bytes=response_bytes)
+        logger.info(f"Report job with id {report_job_id} streamed to: {report_path}")
 
         return report_path
 
@@ -66,43 +262,28 @@ class ReportManager:
             return directory
 
 
-def process_adx_fillrate_report(report_path: PurePath, min_adrequests: int = 50000) -> pandas.DataFrame:
-    excluded_domains = "***REMOVED***"
-    dataframe = pandas.read_csv(report_path, compression="gzip")
-    dataframe.rename(
-            columns={
-                "Dimension.AD_EXCHANGE_DATE": "Date",
-                "Dimension.AD_EXCHANGE_URL": "Domain",
-                "Dimension.AD_EXCHANGE_PRODUCT_NAME": "Product",
-                "Column.AD_EXCHANGE_AD_REQUESTS": "Ad requests",
-                "Column.AD_EXCHANGE_COVERAGE": "Coverage",
-            },
-            inplace=True
+FILLRATE_COLUMNS = [
+    "Dimension.AD_EXCHANGE_DATE",
+    "Dimension.AD_EXCHANGE_URL",
+    "Dimension.AD_EXCHANGE_PRODUCT_NAME",
+    "Column.AD_EXCHANGE_AD_REQUESTS",
+    "Column.AD_EXCHANGE_COVERAGE",
+]
+
+def process_adx_fillrate_report(
+    report_path: PurePath, rules: ReportRules, min_adrequests: int = 50000, chunk_size: int = None
+) -> pandas.DataFrame:
+    """With chunk_size the row rules run chunk by chunk and only the matching rows are kept in memory."""
+    variables = {"min_ad_requests": min_adrequests}
+    if chunk_size:
+        dataframe = pandas.concat(
+            [rules.apply_rows(chunk, variables) for chunk in iter_report_chunks(report_path, chunk_size, FILLRATE_COLUMNS)],
+            ignore_index=True,
         )
-    dataframe = dataframe.loc[~dataframe["Domain"].str.contains(excluded_domains)]
-    dataframe = dataframe[(dataframe["Ad requests"] > min_adrequests) & (dataframe["Coverage"] <= 0.1)]
-    dataframe["Coverage"] = dataframe["Coverage"].apply(lambda x: "{0:.2f} %".format(x * 100))
-    dataframe = dataframe.sort_values(["Coverage"], ascending=False).reset_index(drop=True)
+        dataframe = rules.apply_rest(dataframe, variables)
+    else:
+        dataframe = rules.apply(load_report(report_path, FILLRATE_COLUMNS), variables)
+    dataframe = dataframe.reset_index(drop=True)
     dataframe.index += 1
 
     return dataframe
-
-def dataframe_to_html(dataframe):
-    if dataframe is None:
-        return None
-    result = """<html><head><style>
-    h2 {text-align: center;font-family: Helvetica, Arial, sans-serif;}
-    table, th, td {border: 1px solid black;border-collapse: collapse;}
-    th, td {padding: 1px;text-align: left;font-family: Helvetica, Arial, sans-serif;font-size: 90%;}
-    table tbody tr:hover {background-color: #dddddd;}
-    .wide {width: 35%;}
-    </style></head><body>"""
-
-    if type(dataframe) == pandas.io.formats.style.Styler:  # type: ignore
-        result += dataframe.render()
-    else:
-        result += dataframe.to_html(classes="wide", escape=False)
-    result += """</body></html>"""
-
-    return result.replace("\n", "")
-
@@ -0,0 +1,91 @@
+import logging
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def contains(series: pd.Series, pattern: str) -> np.ndarray:
+    """Regex search over a column, categorical columns are searched once per category."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        matches = np.append(np.asarray(series.cat.categories.astype(str).str.contains(pattern, regex=True), dtype=bool), False)
+        return matches[series.cat.codes.to_numpy()]
+    return series.astype(str).str.contains(pattern, regex=True).to_numpy(dtype=bool)
+
+
+class ReportRules:
+    """Post-processing steps of a report, read from the rules section of report_manager.yaml.
+
+    Steps run in order, each one a vectorized operation over whole columns.
+    Consecutive filter and exclude steps are combined into a single row mask.
+      rename:  {column: new name}
+      derive:  {column: expression}, DataFrame.eval syntax, @name refers to a variable
+      filter:  expression, rows where it is false are dropped
+      exclude: {column: regex}, rows where the column matches are dropped
+      sort:    {column: ascending}
+      format:  {column: printf style format}, e.g. "%.2f %%"
+    """
+
+    STEPS = ("rename", "derive", "filter", "exclude", "sort", "format")
+    # Steps that only look at one row at a time, so they can run on report chunks.
+    ROW_STEPS = ("rename", "derive", "mask")
+
+    def __init__(self, steps: List[dict]) -> None:
+        self.steps = self.compile(steps)
+
+    @classmethod
+    def compile(cls, steps: List[dict]) -> list:
+        compiled = []
+        for step in steps:
+            if len(step) != 1 or next(iter(step)) not in cls.STEPS:
+                raise ValueError(f"Invalid report rule {step}, expected one of {', '.join(cls.STEPS)}")
+            kind, argument = next(iter(step.items()))
+            if kind in ("filter", "exclude"):
+                if not compiled or compiled[-1][0] != "mask":
+                    compiled.append(("mask", []))
+                compiled[-1][1].append((kind, argument))
+            else:
+                compiled.append((kind, argument))
+        return compiled
+
+    def apply(self, dataframe: pd.DataFrame, variables: Optional[dict] = None) -> pd.DataFrame:
+        return self.run(self.steps, dataframe, variables)
+
+    def apply_rows(self, dataframe: pd.DataFrame, variables: Optional[dict] = None) -> pd.DataFrame:
+        """The leading row-wise steps only, for report chunks. apply_rest finishes the concatenated result."""
+        return self.run(self.steps[:self.row_steps_count()], dataframe, variables)
+
+    def apply_rest(self, dataframe: pd.DataFrame, variables: Optional[dict] = None) -> pd.DataFrame:
+        return self.run(self.steps[self.row_steps_count():], dataframe, variables)
+
+    def row_steps_count(self) -> int:
+        return next((index for index, (kind, _) in enumerate(self.steps) if kind not in self.ROW_STEPS), len(self.steps))
+
+    def run(self, steps: list, dataframe: pd.DataFrame, variables: Optional[dict]) -> pd.DataFrame:
+        variables = variables or {}
+        for kind, argument in steps:
+            if kind == "rename":
+                dataframe = dataframe.rename(columns=argument)
+            elif kind == "derive":
+                dataframe = dataframe.assign(**{
+                    column: dataframe.eval(expression, local_dict=variables) for column, expression in argument.items()
+                })
+            elif kind == "mask":
+                mask = np.ones(len(dataframe), dtype=bool)
+                for mask_kind, mask_argument in argument:
+                    if mask_kind == "filter":
+                        mask &= dataframe.eval(mask_argument, local_dict=variables).to_numpy(dtype=bool)
+                    else:
+                        for column, pattern in mask_argument.items():
+                            mask &= ~contains(dataframe[column], pattern)
+                dataframe = dataframe.loc[mask]
+            elif kind == "sort":
+                dataframe = dataframe.sort_values(list(argument), ascending=list(argument.values()), kind="stable")
+            elif kind == "format":
+                dataframe = dataframe.assign(**{
+                    column: np.char.mod(fmt, dataframe[column].to_numpy()) for column, fmt in argument.items()
+                })
+            logger.debug(f"Report rule {kind}: {len(dataframe)} rows")
+        return dataframe
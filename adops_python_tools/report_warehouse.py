@@ -0,0 +1,179 @@
+import datetime
+import logging
+import os
+from pathlib import PurePath
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow.feather as feather
+import pyarrow.ipc as ipc
+import pytz
+
+from adops_ad_manager import AdOpsAdManagerClient
+from columnar_report import aggregate_report, convert_report, load_report, optimize_dtypes
+from report_manager import ReportManager, ReportRequest
+
+logger = logging.getLogger(__name__)
+
+
+class ReportWarehouse:
+    """Daily partitions of a report per network, so a rolling window only needs the missing days from Ad Manager.
+
+    Configured in the "warehouse" section of report_manager.yaml. Every report type
+    listed there names its date dimension and window length, days are combined
+    with the "aggregations" of the report type. Ad Exchange data of the last
+    refreshDays days is not final, so these days are fetched again on every run.
+    """
+
+    def __init__(self, report_manager: ReportManager) -> None:
+        self.report_manager = report_manager
+        self.config = report_manager.config.get("warehouse", {})
+
+    def enabled(self, report_type: str) -> bool:
+        return report_type in self.config.get("reports", {})
+
+    def partition_dir(self, network_code: str, report_type: str) -> PurePath:
+        return PurePath(self.config["path"], str(network_code), report_type)
+
+    def partition_path(self, network_code: str, report_type: str, date: datetime.date) -> PurePath:
+        return PurePath(self.partition_dir(network_code, report_type), f"{date.isoformat()}.feather")
+
+    def stored_dates(self, network_code: str, report_type: str) -> List[datetime.date]:
+        directory = self.partition_dir(network_code, report_type)
+        if not os.path.exists(directory):
+            return []
+        return sorted(
+            datetime.date.fromisoformat(name[:-len(".feather")]) for name in os.listdir(directory) if name.endswith(".feather")
+        )
+
+    def current_dates(self, network_code: str, report_type: str) -> List[datetime.date]:
+        """Stored dates whose partition has every column of the report query, older ones are fetched again."""
+        columns = {f"Column.{column}" for column in self.report_manager.config[report_type]["columns"]}
+        dates = []
+        for date in self.stored_dates(network_code, report_type):
+            with ipc.open_file(str(self.partition_path(network_code, report_type, date))) as partition:
+                if columns.issubset(partition.schema.names):
+                    dates.append(date)
+        return dates
+
+    def window(self, report_type: str) -> List[datetime.date]:
+        days = self.config["reports"][report_type].get("days", 30)
+        # Report days follow the timeZoneType of the report query, not the local clock.
+        today = datetime.datetime.now(pytz.timezone(self.config.get("timeZone", "America/Los_Angeles"))).date()
+        return [today - datetime.timedelta(day) for day in range(days, 0, -1)]
+
+    def refresh_dates(self, report_type: str) -> List[datetime.date]:
+        return self.window(report_type)[-self.config.get("refreshDays", 3):]
+
+    def dates_to_fetch(self, network_code: str, report_type: str) -> List[datetime.date]:
+        """Days of the window without a current partition, and the refreshed recent days."""
+        final = set(self.current_dates(network_code, report_type)) - set(self.refresh_dates(report_type))
+        return sorted(set(self.window(report_type)) - final)
+
+    def missing_request(self, client: AdOpsAdManagerClient, report_type: str) -> Optional[ReportRequest]:
+        """One report request covering the days of the window to fetch, with the date dimension added."""
+        network_code = str(client.current_network["networkCode"])
+        missing = self.dates_to_fetch(network_code, report_type)
+        if not missing:
+            logger.info(f"All {report_type} partitions of network {network_code} are stored")
+            return None
+
+        date_dimension = self.config["reports"][report_type]["dateDimension"]
+        dimensions = self.report_manager.config[report_type]["dimensions"]
+        if date_dimension not in dimensions:
+            dimensions = [date_dimension] + dimensions
+        logger.info(f"Fetching {report_type} of network {network_code} from {missing[0]} to {missing[-1]}")
+        return ReportRequest(client, report_type, missing[0], missing[-1], dimensions)
+
+    def store(self, request: ReportRequest, report_path: Optional[PurePath]) -> List[datetime.date]:
+        """Splits a report fetched for missing_request into daily partitions."""
+        network_code = str(request.client.current_network["networkCode"])
+        if not report_path:
+            logger.error(f"Missing {request.report_type} partitions of network {network_code} were not fetched")
+            return []
+
+        dataframe = load_report(report_path)
+        date_column = f"Dimension.{self.config['reports'][request.report_type]['dateDimension']}"
+        dates = pd.to_datetime(dataframe[date_column]).dt.date
+        os.makedirs(self.partition_dir(network_code, request.report_type), exist_ok=True)
+        missing = self.dates_to_fetch(network_code, request.report_type)
+        refresh_dates = set(self.refresh_dates(request.report_type))
+        stored = []
+        for date in missing:
+            partition = dataframe.loc[dates == date].drop(columns=date_column).reset_index(drop=True)
+            # Older days without any row are stored empty, so they are not requested again.
+            # Recent ones may just not be reported yet.
+            if partition.empty and date in refresh_dates:
+                logger.info(f"No {request.report_type} rows of network {network_code} for {date} yet")
+                continue
+            self.write_partition(self.partition_path(network_code, request.report_type, date), optimize_dtypes(partition))
+            stored.append(date)
+        self.expire(network_code, request.report_type)
+
+        return stored
+
+    def fetch_missing(self, client: AdOpsAdManagerClient, report_type: str) -> List[datetime.date]:
+        """Downloads the days of the window without a partition, and the recent days, in one report job and splits it by day."""
+        return self.fetch_missing_many({report_type: client}, report_type).get(report_type, [])
+
+    def fetch_missing_many(self, clients: Dict[str, AdOpsAdManagerClient], report_type: str) -> Dict[str, List[datetime.date]]:
+        """fetch_missing for several networks, with all report jobs running concurrently."""
+        requests = {}
+        for key, client in clients.items():
+            request = self.missing_request(client, report_type)
+            if request:
+                requests[key] = request
+        reports = self.report_manager.get_reports(requests)
+        return {key: self.store(request, reports[key]) for key, request in requests.items()}
+
+    @staticmethod
+    def write_partition(path: PurePath, dataframe: pd.DataFrame) -> None:
+        feather.write_feather(dataframe, f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def expire(self, network_code: str, report_type: str) -> None:
+        retention_days = self.config.get("retentionDays", self.config["reports"][report_type].get("days", 30))
+        oldest = datetime.date.today() - datetime.timedelta(retention_days)
+        for date in self.stored_dates(network_code, report_type):
+            if date < oldest:
+                os.remove(self.partition_path(network_code, report_type, date))
+                logger.debug(f"Expired {report_type} partition {date} of network {network_code}")
+
+    def aggregate(self, network_code: str, report_type: str) -> pd.DataFrame:
+        """Combines the stored partitions of the window into one row per dimension combination."""
+        window = self.window(report_type)
+        dates = [date for date in self.current_dates(network_code, report_type) if date in set(window)]
+        if len(dates) < len(window):
+            logger.warning(f"{report_type} of network {network_code} aggregated from {len(dates)} of {len(window)} days")
+        dataframe = pd.concat(
+            [feather.read_feather(self.partition_path(network_code, report_type, date)) for date in dates], ignore_index=True
+        )
+
+        return aggregate_report(dataframe, self.report_manager.config.get("aggregations", {}).get(report_type, {}))
+
+    def get_report(self, client: AdOpsAdManagerClient, report_type: str="placementPerformance") -> Optional[PurePath]:
+        """Drop-in for ReportManager.get_report: the rolling window report, built from stored daily partitions."""
+        return self.get_reports({report_type: client}, report_type)[report_type]
+
+    def get_reports(self, clients: Dict[str, AdOpsAdManagerClient], report_type: str="placementPerformance") -> Dict[str, Optional[PurePath]]:
+        """Rolling window reports of several networks, keyed like clients."""
+        self.fetch_missing_many(clients, report_type)
+        window = self.window(report_type)
+        output_path = PurePath(
+            self.report_manager.config["outputFolderPath"], datetime.datetime.now().strftime("%d%m%Y_%H%M")
+        )
+        self.report_manager.create_directory(output_path)
+        reports = {}
+        for key, client in clients.items():
+            network_code = str(client.current_network["networkCode"])
+            if not self.stored_dates(network_code, report_type):
+                logger.error(f"No {report_type} partitions of network {network_code} are stored")
+                reports[key] = None
+                continue
+            report_path = PurePath(output_path, f"{network_code}_{report_type}_{window[0]}_{window[-1]}_rolling.csv.gz")
+            self.aggregate(network_code, report_type).to_csv(report_path, index=False, compression="gzip")
+            logger.info(f"Rolling {report_type} report of network {network_code} written to {report_path}")
+            convert_report(report_path)
+            reports[key] = report_path
+
+        return reports
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
 import logging
+from pathlib import PurePath
 
-from constants import PLACEMENT_MANAGER_PATH
+from adops_ad_manager import AdOpsAdManagerClient
+from api_metrics import API_METRICS
+from config_reader import ConfigReader
+from constants import METRICS_OUTPUT_PATH, PLACEMENT_MANAGER_PATH
+from network_pool import AdManagerClientPool, NetworkJob
 from placement_manager import PlacementManager
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -9,14 +14,38 @@ logging.getLogger("googleapiclient.discovery_cache").setLevel(logging.ERROR)
 logging.getLogger("adops_ad_manager").setLevel(logging.DEBUG)
 logging.getLogger("placement_manager").setLevel(logging.DEBUG)
 logging.getLogger("report_manager").setLevel(logging.DEBUG)
+logging.getLogger("network_pool").setLevel(logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+PUBLISHERS = ["Company Y", "Company A", "Company E", "Company I", "Company p"]
+
+def update_publisher_placements(client: AdOpsAdManagerClient, publisher: str, report_path: PurePath) -> None:
+    PlacementManager(PLACEMENT_MANAGER_PATH).update_performance_placements(publisher, client, report_path)
+
 def main():
-    PlacementManager(PLACEMENT_MANAGER_PATH).update_performance_placements("Company Y")
-    PlacementManager(PLACEMENT_MANAGER_PATH).update_performance_placements("Company A")
-    PlacementManager(PLACEMENT_MANAGER_PATH).update_performance_placements("Company E")
-    PlacementManager(PLACEMENT_MANAGER_PATH).update_performance_placements("Company I")
-    PlacementManager(PLACEMENT_MANAGER_PATH).update_performance_placements("Company p")
+    config = ConfigReader(PLACEMENT_MANAGER_PATH).read_yaml_config()
+    pool = AdManagerClientPool()
+    # Report jobs of all publishers run at once, the slowest one bounds the wait.
+    report_paths = PlacementManager(PLACEMENT_MANAGER_PATH).get_performance_reports(
+        {publisher: pool.get(config[publisher]["email"], config[publisher]["networkCode"]) for publisher in PUBLISHERS}
+    )
+    jobs = {
+        publisher: NetworkJob(
+            config[publisher]["email"],
+            config[publisher]["networkCode"],
+            {"publisher": publisher, "report_path": report_paths[publisher]},
+        )
+        for publisher in PUBLISHERS
+        if report_paths[publisher]
+    }
+    for publisher in [publisher for publisher in PUBLISHERS if publisher not in jobs]:
+        logger.error(f"Placements of {publisher} were not updated: performance report is missing")
+    results = pool.run(update_publisher_placements, jobs)
+    for publisher, result in results.items():
+        if result.error:
+            logger.error(f"Placements of {publisher} ({result.network_code}) were not updated: {result.error}")
+    API_METRICS.log_summary()
+    API_METRICS.export(METRICS_OUTPUT_PATH)
 
 if __name__ == "__main__":
     main()